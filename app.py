@@ -1,43 +1,221 @@
-import os, json, sqlite3, datetime, hashlib, secrets, threading, random, re
-from flask import Flask, request, jsonify, Response
+import os, json, sqlite3, datetime, hashlib, secrets, threading, random, re, contextlib, queue, time, atexit, base64
+from collections import OrderedDict, deque
+from flask import Flask, request, jsonify, Response, stream_with_context
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)   # /static/ is served from STATIC_ASSETS
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 
-AUTH_DB = os.path.join(os.path.dirname(__file__), "users.db")
+AUTH_DB = os.environ.get("AUTH_DB", os.path.join(os.path.dirname(__file__), "users.db"))
 
-_db_lock = threading.Lock()
+# ── SQLITE CONNECTION POOL ────────────────────────────────────────────────────
+class SQLitePool:
+    """One long-lived connection per worker thread for a single database file.
+
+    Connections are opened lazily, configured once (WAL, synchronous,
+    busy_timeout) and kept for the life of the thread, so sqlite3's prepared
+    statement cache is reused across requests. Reads run straight on the
+    thread's connection — WAL readers never wait on a writer — while writes
+    are serialized per database by `write_lock`.
+    """
+
+    def __init__(self, path, timeout=30, row_factory=None, synchronous="NORMAL"):
+        self.path        = path
+        self.timeout     = timeout
+        self.row_factory = row_factory
+        self.synchronous = synchronous
+        self.write_lock  = threading.RLock()
+        self._local      = threading.local()
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use (or after a fork)."""
+        local = self._local
+        con = getattr(local, "con", None)
+        if con is not None and local.pid == os.getpid():
+            return con
+        con = sqlite3.connect(self.path, timeout=self.timeout,
+                              check_same_thread=False, cached_statements=256)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(f"PRAGMA synchronous={self.synchronous}")
+        con.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        if self.row_factory:
+            con.row_factory = self.row_factory
+        local.con, local.pid, local.depth = con, os.getpid(), 0
+        return con
+
+    def read(self, query, params=(), fetchone=False):
+        """Run a SELECT on this thread's connection without taking the write lock."""
+        cur = self.connection().execute(query, params)
+        return cur.fetchone() if fetchone else cur.fetchall()
+
+    def iterate(self, query, params=(), size=500):
+        """Run a SELECT and yield its rows in lists of up to `size`, so large
+        results can be streamed without materializing them."""
+        cur = self.connection().execute(query, params)
+        try:
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cur.close()
+
+    def write(self, query, params=(), fetchone=False, fetchall=False):
+        """Run one statement under the write lock and commit, retrying on lock."""
+        import time
+        for attempt in range(5):
+            try:
+                with self.write_lock:
+                    con = self.connection()
+                    cur = con.execute(query, params)
+                    result = None
+                    if fetchone: result = cur.fetchone()
+                    elif fetchall: result = cur.fetchall()
+                    if not self._local.depth:
+                        con.commit()
+                    return result
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e) and attempt < 4 and not self._local.depth:
+                    time.sleep(0.5 * (attempt + 1))
+                    continue
+                raise
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the write lock and commit (or roll back) once at the end; nests."""
+        with self.write_lock:
+            con = self.connection()
+            local = self._local
+            local.depth += 1
+            try:
+                yield con
+            except BaseException:
+                local.depth -= 1
+                if not local.depth: con.rollback()
+                raise
+            local.depth -= 1
+            if not local.depth: con.commit()
+
+    def migrate(self, migrations):
+        """Bring the schema up to date. `migrations` is an ordered list of
+        (name, step) pairs; step N is applied once, when PRAGMA user_version < N,
+        and the version is bumped in the same transaction. A step is either a
+        list of SQL statements or a callable taking the connection.
+
+        BEGIN IMMEDIATE serializes concurrent workers: whoever loses the race
+        waits, then finds user_version already bumped and skips the step.
+        """
+        with self.write_lock:
+            con = self.connection()
+            for version, (name, step) in enumerate(migrations, 1):
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    if con.execute("PRAGMA user_version").fetchone()[0] >= version:
+                        con.rollback()
+                        continue
+                    if callable(step):
+                        step(con)
+                    else:
+                        for statement in step:
+                            con.execute(statement)
+                    con.execute(f"PRAGMA user_version={version}")
+                    con.commit()
+                    print(f"Migrated {os.path.basename(self.path)} to v{version}: {name}")
+                except BaseException:
+                    con.rollback()
+                    raise
+
+
+# ── BACKGROUND THREADS (started per process, on the first request) ────────────
+# SRD_BACKGROUND=0 keeps them all off (tests, one-off scripts)
+SRD_BACKGROUND       = os.environ.get("SRD_BACKGROUND", "1") != "0"
+_background_starters = []
+_background_pid      = None
+_background_lock     = threading.Lock()
+
+def background(start):
+    """Register `start()` to run once in each serving process. Nothing starts
+    at import: under a preload/fork server (gunicorn --preload) threads
+    started in the master would not exist in the workers."""
+    _background_starters.append(start)
+    return start
+
+def background_thread(target):
+    """Register `target` to run on a daemon thread in each serving process."""
+    background(lambda: threading.Thread(target=target, daemon=True).start())
+
+def start_background():
+    """Run the registered starters if this process hasn't yet (cheap otherwise)."""
+    global _background_pid
+    if not SRD_BACKGROUND or _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+        for start in _background_starters:
+            start()
+
+@app.before_request
+def _start_background():
+    start_background()
+
+
+def _add_column(con, table, column, decl):
+    """ALTER TABLE ... ADD COLUMN, skipped if the column is already there."""
+    if column not in [r[1] for r in con.execute(f"PRAGMA table_info({table})")]:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+class _PooledConnection:
+    """Handle returned by get_db()/get_analytics_db()/get_blog_db().
+
+    Behaves like the sqlite3 connection it wraps, except close() hands the
+    connection back to the pool (rolling back anything left uncommitted)
+    instead of closing it.
+    """
+    __slots__ = ("_pool", "_con")
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._con  = pool.connection()
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def close(self):
+        if self._con.in_transaction and not self._pool._local.depth:
+            self._con.rollback()
+
+
+USERS_POOL = SQLitePool(AUTH_DB, timeout=60, row_factory=sqlite3.Row)
 
 def get_db():
-    """Get a SQLite connection with WAL mode and locking to prevent conflicts."""
-    con = sqlite3.connect(AUTH_DB, timeout=60, check_same_thread=False)
-    con.execute("PRAGMA journal_mode=WAL")
-    con.execute("PRAGMA synchronous=NORMAL")
-    con.execute("PRAGMA busy_timeout=60000")
-    con.row_factory = sqlite3.Row
-    return con
+    """Get this thread's pooled users.db connection (WAL, row factory set)."""
+    return _PooledConnection(USERS_POOL)
 
 def db_execute(query, params=(), fetchone=False, fetchall=False):
-    """Thread-safe DB execute with auto-retry on lock."""
-    import time
-    for attempt in range(5):
-        try:
-            with _db_lock:
-                con = sqlite3.connect(AUTH_DB, timeout=60, check_same_thread=False)
-                con.execute("PRAGMA journal_mode=WAL")
-                con.execute("PRAGMA busy_timeout=60000")
-                cur = con.execute(query, params)
-                result = None
-                if fetchone: result = cur.fetchone()
-                elif fetchall: result = cur.fetchall()
-                con.commit()
-                con.close()
-                return result
-        except sqlite3.OperationalError as e:
-            if "locked" in str(e) and attempt < 4:
-                time.sleep(0.5 * (attempt + 1))
-                continue
-            raise
+    """Thread-safe DB execute. SELECTs skip the write lock; writes retry on lock."""
+    if query.lstrip()[:6].upper() == "SELECT":
+        result = USERS_POOL.read(query, params, fetchone=fetchone)
+        return result if (fetchone or fetchall) else None
+    return USERS_POOL.write(query, params, fetchone=fetchone, fetchall=fetchall)
+
+CHAT_HISTORY_SLOTS = 100
+
+def _backfill_chat_ring(con):
+    """Give rows written before the ring existed a slot, oldest first, and
+    seed each user's cursor after their newest row."""
+    if not con.execute("SELECT 1 FROM chat_history WHERE slot IS NULL LIMIT 1").fetchone():
+        return
+    con.execute("""DELETE FROM chat_history WHERE id IN (SELECT id FROM
+        (SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id DESC) AS rn FROM chat_history)
+        WHERE rn > ?)""", (CHAT_HISTORY_SLOTS,))
+    con.execute("""UPDATE chat_history SET slot = r.rn - 1 FROM
+        (SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS rn FROM chat_history) r
+        WHERE r.id = chat_history.id""")
+    con.execute("""INSERT OR REPLACE INTO chat_ring (user_id, next_seq)
+        SELECT user_id, COUNT(*) FROM chat_history GROUP BY user_id""")
 
 def init_auth_db():
     con = get_db()
@@ -49,7 +227,9 @@ def init_auth_db():
         google_id     TEXT,
         avatar        TEXT,
         created_at    TEXT    DEFAULT (datetime('now')),
-        last_login    TEXT
+        last_login    TEXT,
+        reset_token   TEXT,
+        reset_token_expires TEXT
     )""")
     con.execute("""CREATE TABLE IF NOT EXISTS sessions (
         token      TEXT PRIMARY KEY,
@@ -64,14 +244,28 @@ def init_auth_db():
         hair_concerns TEXT,
         treatments   TEXT,
         products_tried TEXT,
-        last_updated TEXT DEFAULT (datetime('now'))
+        last_updated TEXT DEFAULT (datetime('now')),
+        site_rating  INTEGER DEFAULT 0,
+        site_review  TEXT DEFAULT ''
     )""")
     con.execute("""CREATE TABLE IF NOT EXISTS chat_history (
         id         INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id    INTEGER NOT NULL,
         role       TEXT NOT NULL,
         content    TEXT NOT NULL,
-        ts         TEXT DEFAULT (datetime('now'))
+        ts         TEXT DEFAULT (datetime('now')),
+        slot       INTEGER
+    )""")
+    # Per-user write cursor for the chat_history ring (see _insert_chat_message)
+    con.execute("""CREATE TABLE IF NOT EXISTS chat_ring (
+        user_id  INTEGER PRIMARY KEY,
+        next_seq INTEGER NOT NULL
+    )""")
+    con.execute("""CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id         INTEGER PRIMARY KEY,
+        summary         TEXT    NOT NULL,
+        last_message_id INTEGER NOT NULL,
+        updated_at      TEXT    DEFAULT (datetime('now'))
     )""")
     con.execute("""CREATE TABLE IF NOT EXISTS premium_codes (
         id       INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -97,27 +291,137 @@ def create_session(user_id):
     db_execute("UPDATE users SET last_login=? WHERE id=?", (datetime.datetime.utcnow().isoformat(), user_id))
     return token
 
+# ── SESSION CACHE (token → user, shared by every thread in the process) ──────
+SESSION_CACHE_TTL  = float(os.environ.get("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+SESSION_EPOCH_SECONDS = float(os.environ.get("SESSION_EPOCH_SECONDS", "1"))
+
+class SessionCache:
+    """Validated tokens and their user, held for SESSION_CACHE_TTL seconds and
+    never past the session's own expires_at. Only hits are cached.
+
+    Logout, history clears and profile updates invalidate entries at once in
+    this process. Other worker processes see a profile change within the TTL.
+    A logout also bumps a shared revocation epoch; `read_epoch()` is polled at
+    most every SESSION_EPOCH_SECONDS and a new value empties the cache, so a
+    logout reaches every worker within that window.
+    """
+
+    def __init__(self, read_epoch, ttl=SESSION_CACHE_TTL, max_size=SESSION_CACHE_SIZE,
+                 epoch_every=SESSION_EPOCH_SECONDS):
+        self.read_epoch  = read_epoch
+        self.ttl         = ttl
+        self.max_size    = max_size
+        self.epoch_every = epoch_every
+        self.generation  = 0     # bumped when the cache is emptied; see put()
+        self._lock       = threading.Lock()
+        self._entries    = OrderedDict()   # token -> (user, deadline)
+        self._by_user    = {}              # user_id -> {tokens}
+        self._epoch      = None
+        self._epoch_at   = 0.0
+
+    def _check_epoch(self):
+        now = time.monotonic()
+        if now - self._epoch_at < self.epoch_every:
+            return
+        self._epoch_at = now
+        try:
+            epoch = self.read_epoch()
+        except Exception as e:
+            print("Session epoch error:", e)
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                if self._epoch is not None:
+                    self._entries.clear()
+                    self._by_user.clear()
+                    self.generation += 1
+                self._epoch = epoch
+
+    def get(self, token):
+        self._check_epoch()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._drop(token)
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token, user, expires_at, generation=None):
+        """Cache a lookup. Pass the `generation` read before the DB lookup: if
+        the cache was emptied since, the row may predate a logout and is dropped."""
+        try:
+            remaining = (datetime.datetime.fromisoformat(expires_at) - datetime.datetime.utcnow()).total_seconds()
+        except (TypeError, ValueError):
+            remaining = 0
+        ttl = min(self.ttl, remaining)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._drop(token)
+            self._entries[token] = (user, time.monotonic() + ttl)
+            self._by_user.setdefault(user["id"], set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, token=None, user_id=None):
+        """Forget one token, or every token belonging to `user_id`."""
+        with self._lock:
+            if token is not None:
+                self._drop(token)
+            if user_id is not None:
+                for t in list(self._by_user.get(user_id, ())):
+                    self._drop(t)
+
+    def _drop(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._by_user.get(entry[0]["id"])
+            if tokens:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_user[entry[0]["id"]]
+
+SESSION_CACHE = SessionCache(
+    lambda: USERS_POOL.read("SELECT epoch FROM session_epoch WHERE id=1", fetchone=True)[0])
+
+def revoke_session(token):
+    """Delete the session and bump the revocation epoch other workers poll."""
+    with USERS_POOL.transaction() as con:
+        con.execute("DELETE FROM sessions WHERE token=?", (token,))
+        con.execute("UPDATE session_epoch SET epoch = epoch + 1 WHERE id=1")
+    SESSION_CACHE.invalidate(token=token)
+
 def get_user_from_token(token):
     if not token: return None
-    row = db_execute("""SELECT u.id,u.email,u.name,u.avatar FROM users u
+    user = SESSION_CACHE.get(token)
+    if user: return dict(user)
+    generation = SESSION_CACHE.generation
+    row = db_execute("""SELECT u.id,u.email,u.name,u.avatar,s.expires_at FROM users u
         JOIN sessions s ON s.user_id=u.id
         WHERE s.token=? AND s.expires_at > datetime('now')""", (token,), fetchone=True)
-    if row: return {"id":row[0],"email":row[1],"name":row[2],"avatar":row[3]}
-    return None
+    if not row: return None
+    user = {"id":row[0],"email":row[1],"name":row[2],"avatar":row[3]}
+    SESSION_CACHE.put(token, user, row[4], generation)
+    return dict(user)
+
+def request_auth_token():
+    return request.headers.get("X-Auth-Token") or request.cookies.get("srd_token")
 
 def get_current_user():
-    token = request.headers.get("X-Auth-Token") or request.cookies.get("srd_token")
-    return get_user_from_token(token)
+    return get_user_from_token(request_auth_token())
 
 def get_hair_profile(user_id):
-    con = get_db()
-    row = con.execute("SELECT * FROM hair_profiles WHERE user_id=?", (user_id,)).fetchone()
-    con.close()
+    row = USERS_POOL.read("SELECT * FROM hair_profiles WHERE user_id=?", (user_id,), fetchone=True)
     if not row: return {}
     return {"hair_type":row[2],"hair_concerns":row[3],"treatments":row[4],"products_tried":row[5]}
 
-def save_hair_profile(user_id, data):
-    con = get_db()
+def _upsert_hair_profile(con, user_id, data):
     con.execute("""INSERT INTO hair_profiles (user_id,hair_type,hair_concerns,treatments,products_tried)
         VALUES (?,?,?,?,?) ON CONFLICT(user_id) DO UPDATE SET
         hair_type=excluded.hair_type, hair_concerns=excluded.hair_concerns,
@@ -125,34 +429,37 @@ def save_hair_profile(user_id, data):
         last_updated=datetime('now')""",
         (user_id, data.get("hair_type",""), data.get("hair_concerns",""),
          data.get("treatments",""), data.get("products_tried","")))
-    con.commit()
-    con.close()
+
+def save_hair_profile(user_id, data):
+    with USERS_POOL.transaction() as con:
+        _upsert_hair_profile(con, user_id, data)
 
 def get_chat_history(user_id, limit=20):
-    con = get_db()
-    rows = con.execute("""SELECT role,content FROM chat_history
-        WHERE user_id=? ORDER BY id DESC LIMIT ?""", (user_id, limit)).fetchall()
-    con.close()
+    rows = USERS_POOL.read("""SELECT role,content FROM chat_history
+        WHERE user_id=? ORDER BY id DESC LIMIT ?""", (user_id, limit))
     return [{"role":r[0],"content":r[1]} for r in reversed(rows)]
 
+def _insert_chat_message(con, user_id, role, content):
+    """Write into the user's ring of CHAT_HISTORY_SLOTS rows: bump the cursor and
+    overwrite the slot it lands on. The replaced row gets a fresh id, so
+    ORDER BY id still returns messages oldest → newest. O(1) per message."""
+    seq = con.execute("""INSERT INTO chat_ring (user_id, next_seq) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET next_seq = next_seq + 1
+        RETURNING next_seq""", (user_id,)).fetchone()[0]
+    con.execute("""INSERT OR REPLACE INTO chat_history (user_id,slot,role,content)
+        VALUES (?,?,?,?)""", (user_id, (seq - 1) % CHAT_HISTORY_SLOTS, role, content))
+
 def save_chat_message(user_id, role, content):
-    con = get_db()
-    con.execute("INSERT INTO chat_history (user_id,role,content) VALUES (?,?,?)",
-                (user_id, role, content))
-    con.execute("""DELETE FROM chat_history WHERE user_id=? AND id NOT IN
-        (SELECT id FROM chat_history WHERE user_id=? ORDER BY id DESC LIMIT 100)""",
-                (user_id, user_id))
-    con.commit()
-    con.close()
+    with USERS_POOL.transaction() as con:
+        _insert_chat_message(con, user_id, role, content)
 
 # ── ANALYTICS DB ─────────────────────────────────────────────────────────────
-DB_PATH = os.path.join(os.path.dirname(__file__), "analytics.db")
+DB_PATH = os.environ.get("ANALYTICS_DB", os.path.join(os.path.dirname(__file__), "analytics.db"))
+
+ANALYTICS_POOL = SQLitePool(DB_PATH, timeout=30)
 
 def get_analytics_db():
-    con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
-    con.execute("PRAGMA journal_mode=WAL")
-    con.execute("PRAGMA busy_timeout=30000")
-    return con
+    return _PooledConnection(ANALYTICS_POOL)
 
 def init_db():
     con = get_analytics_db()
@@ -172,27 +479,273 @@ def init_db():
         tip_amount TEXT,
         product    TEXT
     )""")
+    con.execute("""CREATE TABLE IF NOT EXISTS llm_usage (
+        id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts                 TEXT    NOT NULL,
+        endpoint           TEXT,
+        model              TEXT,
+        input_tokens       INTEGER,
+        output_tokens      INTEGER,
+        cache_read_tokens  INTEGER,
+        cache_write_tokens INTEGER,
+        history_turns      INTEGER,
+        dropped_turns      INTEGER
+    )""")
     con.commit(); con.close()
 
 init_db()
 
+# ── ANALYTICS ROLLUPS (counts kept per all-time / day / hour bucket) ─────────
+# One row per (period, bucket, metric, key):
+#   events, tips               key ''      n = rows logged
+#   product, concern, lang     key value   n = events with that value
+#   tip_amount                 key amount  n = tips with that amount
+#   rating                     key ''      n = rated tips, total = sum of ratings
+ROLLUP_PERIODS = (
+    ("all",  lambda ts: ""),
+    ("day",  lambda ts: ts[:10]),
+    ("hour", lambda ts: ts[:13]),
+)
+
+ROLLUP_UPSERT = """INSERT INTO rollups (period, bucket, metric, key, n, total) VALUES (?,?,?,?,?,?)
+    ON CONFLICT(period, bucket, metric, key) DO UPDATE SET
+    n = n + excluded.n, total = total + excluded.total"""
+
+def _create_rollups(con):
+    con.execute("""CREATE TABLE IF NOT EXISTS rollups (
+        period TEXT    NOT NULL,
+        bucket TEXT    NOT NULL,
+        metric TEXT    NOT NULL,
+        key    TEXT    NOT NULL,
+        n      INTEGER NOT NULL DEFAULT 0,
+        total  REAL    NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, bucket, metric, key)
+    ) WITHOUT ROWID""")
+    # Backfill from the raw tables
+    for period, bucket in (("all", "''"), ("day", "substr(ts,1,10)"), ("hour", "substr(ts,1,13)")):
+        for metric, key, table, where, total in (
+                ("events",     "''",                        "events", "",                 "0"),
+                ("product",    "COALESCE(product,'')",      "events", "",                 "0"),
+                ("concern",    "COALESCE(concern,'')",      "events", "",                 "0"),
+                ("lang",       "COALESCE(lang,'')",         "events", "",                 "0"),
+                ("tips",       "''",                        "tips",   "",                 "0"),
+                ("tip_amount", "COALESCE(tip_amount,'')",   "tips",   "",                 "0"),
+                ("rating",     "''",                        "tips",   "WHERE rating > 0", "SUM(rating)")):
+            con.execute(f"""INSERT INTO rollups (period, bucket, metric, key, n, total)
+                SELECT '{period}', {bucket}, '{metric}', {key}, COUNT(*), {total}
+                FROM {table} {where} GROUP BY 2, 4""")
+
+def rollup_totals(metric, period="all", bucket=""):
+    """[(key, n, total)] for one metric in one bucket, most frequent first."""
+    rows = ANALYTICS_POOL.read("""SELECT key, n, total FROM rollups
+        WHERE period=? AND bucket=? AND metric=?""", (period, bucket, metric))
+    return sorted((tuple(r) for r in rows), key=lambda r: -r[1])
+
+def rollup_count(metric, period="all", bucket=""):
+    rows = rollup_totals(metric, period, bucket)
+    return rows[0][1] if rows else 0
+
+def _create_movement_ring(con):
+    # Shared movement feed: fixed ring of slots + one state row (sequence
+    # counter, simulated-event leader lease, analytics cursor)
+    con.execute("""CREATE TABLE IF NOT EXISTS movement_ring (
+        slot  INTEGER PRIMARY KEY,
+        seq   INTEGER NOT NULL,
+        event TEXT    NOT NULL
+    )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_movement_ring_seq ON movement_ring(seq)")
+    con.execute("""CREATE TABLE IF NOT EXISTS movement_state (
+        id           INTEGER PRIMARY KEY CHECK (id = 1),
+        seq          INTEGER NOT NULL DEFAULT 0,
+        leader       TEXT,
+        lease_until  REAL    NOT NULL DEFAULT 0,
+        events_after INTEGER NOT NULL DEFAULT 0
+    )""")
+    con.execute("""INSERT OR IGNORE INTO movement_state (id, events_after)
+        SELECT 1, COALESCE(MAX(id), 0) FROM events""")
+
+ANALYTICS_MIGRATIONS = [
+    ("rollups", _create_rollups),
+    ("time-range indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)",
+        "CREATE INDEX IF NOT EXISTS idx_tips_ts ON tips(ts)",
+        # Covering index for one metric's series over a bucket range
+        "CREATE INDEX IF NOT EXISTS idx_rollups_series ON rollups(period, metric, bucket, key, n, total)",
+    ]),
+    ("movement ring", _create_movement_ring),
+]
+
+ANALYTICS_POOL.migrate(ANALYTICS_MIGRATIONS)
+
+# ── ANALYTICS WRITER (write-behind: requests enqueue, one thread batches) ─────
+ANALYTICS_FLUSH_MS   = int(os.environ.get("ANALYTICS_FLUSH_MS", "250"))
+ANALYTICS_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", "200"))
+ANALYTICS_QUEUE_SIZE = int(os.environ.get("ANALYTICS_QUEUE_SIZE", "10000"))
+ANALYTICS_BLOCK_MS   = int(os.environ.get("ANALYTICS_BLOCK_MS", "0"))   # wait this long on a full queue before dropping
+
+class AnalyticsWriter:
+    """Bounded in-memory queue of INSERTs drained by a background thread.
+
+    The thread writes whatever has accumulated every ANALYTICS_FLUSH_MS, or as
+    soon as ANALYTICS_BATCH_SIZE rows are waiting, in one transaction with
+    executemany per statement; if that batch fails, its rows are retried one
+    per transaction so only the bad ones are lost (counted as failed). When
+    the queue is full, submit() waits up to ANALYTICS_BLOCK_MS and then drops
+    the row and counts it. close() (run at exit) writes out everything still
+    queued.
+    """
+    _STOP = object()
+
+    def __init__(self, pool, flush_ms=ANALYTICS_FLUSH_MS, batch_size=ANALYTICS_BATCH_SIZE,
+                 max_queue=ANALYTICS_QUEUE_SIZE, block_ms=ANALYTICS_BLOCK_MS):
+        self.pool       = pool
+        self.interval   = flush_ms / 1000
+        self.batch_size = batch_size
+        self.block      = block_ms / 1000
+        self.queue      = queue.Queue(maxsize=max_queue)
+        self.stats      = {"written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+        self.on_flush   = []    # callables run (in the writer thread) after each committed batch
+        self._lock      = threading.Lock()
+        self._thread    = None
+        self._pid       = None
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork (gunicorn --preload): start one per process
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._pid != os.getpid() or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def submit(self, query, params, rollup=None):
+        """Queue one INSERT. `rollup` is (ts, [(metric, key, value), ...]): rollup
+        rows bumped in the same transaction as the insert."""
+        self._ensure_thread()
+        try:
+            if self.block:
+                self.queue.put((query, params, rollup), timeout=self.block)
+            else:
+                self.queue.put_nowait((query, params, rollup))
+        except queue.Full:
+            with self._lock:
+                self.stats["dropped"] += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch, stop = [], item is self._STOP
+            if not stop:
+                batch.append(item)
+            deadline = time.monotonic() + self.interval
+            while not stop and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if stop:
+                # Drain whatever is left before exiting
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not self._STOP:
+                        batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _commit(self, items):
+        """Write items (and their rollup deltas) in one transaction; returns
+        the rows grouped by statement. Raises if any of them fails."""
+        grouped, deltas = {}, {}
+        for query, params, rollup in items:
+            grouped.setdefault(query, []).append(params)
+            if rollup:
+                ts, metrics = rollup
+                for period, bucket_of in ROLLUP_PERIODS:
+                    bucket = bucket_of(ts)
+                    for metric, key, value in metrics:
+                        d = deltas.setdefault((period, bucket, metric, key or ""), [0, 0])
+                        d[0] += 1; d[1] += value
+        with self.pool.transaction() as con:
+            for query, rows in grouped.items():
+                con.executemany(query, rows)
+            if deltas:
+                con.executemany(ROLLUP_UPSERT, [k + tuple(v) for k, v in deltas.items()])
+        return grouped
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            try:
+                grouped, failed = self._commit(batch), 0
+            except Exception as e:
+                # One bad row must not cost everyone else's: retry one at a time
+                print("Analytics writer error, retrying batch row by row:", e)
+                grouped, failed = {}, 0
+                for item in batch:
+                    try:
+                        for query, rows in self._commit([item]).items():
+                            grouped.setdefault(query, []).extend(rows)
+                    except Exception as e:
+                        print("Analytics writer dropped row:", e)
+                        failed += 1
+            with self._lock:
+                self.stats["written"] += len(batch) - failed
+                self.stats["failed"]  += failed
+                self.stats["flushes"] += 1
+            if grouped:
+                for callback in self.on_flush:
+                    callback(grouped)
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """Block until everything submitted so far has been written."""
+        if self._thread is not None and self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self, timeout=5):
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def report(self):
+        with self._lock:
+            return {**self.stats, "queued": self.queue.qsize()}
+
+ANALYTICS_WRITER = AnalyticsWriter(ANALYTICS_POOL)
+
 def log_event(lang, user_msg, product, concern):
-    try:
-        con = get_analytics_db()
-        con.execute("INSERT INTO events (ts,lang,user_msg,product,concern) VALUES (?,?,?,?,?)",
-                    (datetime.datetime.utcnow().isoformat(), lang, user_msg, product, concern))
-        con.commit(); con.close()
-    except Exception as e:
-        print("DB log error:", e)
+    ts = datetime.datetime.utcnow().isoformat()
+    ANALYTICS_WRITER.submit("INSERT INTO events (ts,lang,user_msg,product,concern) VALUES (?,?,?,?,?)",
+                            (ts, lang, user_msg, product, concern),
+                            rollup=(ts, [("events", "", 0), ("product", product, 0),
+                                         ("concern", concern, 0), ("lang", lang, 0)]))
 
 def log_tip(lang, rating, tip_amount, product):
-    try:
-        con = get_analytics_db()
-        con.execute("INSERT INTO tips (ts,lang,rating,tip_amount,product) VALUES (?,?,?,?,?)",
-                    (datetime.datetime.utcnow().isoformat(), lang, rating, tip_amount, product))
-        con.commit(); con.close()
-    except Exception as e:
-        print("DB tip log error:", e)
+    ts = datetime.datetime.utcnow().isoformat()
+    metrics = [("tips", "", 0), ("tip_amount", tip_amount, 0)]
+    if isinstance(rating, int) and rating > 0:
+        metrics.append(("rating", "", rating))
+    ANALYTICS_WRITER.submit("INSERT INTO tips (ts,lang,rating,tip_amount,product) VALUES (?,?,?,?,?)",
+                            (ts, lang, rating, tip_amount, product), rollup=(ts, metrics))
 
 def extract_product(text):
     t = text.lower()
@@ -202,16 +755,235 @@ def extract_product(text):
     if "gotika"           in t: return "Gotitas Brillantes"
     return "Unknown"
 
+# Keyword buckets, checked in order — shared by extract_concern and the response cache
+CONCERN_KEYWORDS = [
+    ("damaged/falling", ["damag","break","weak","fall","shed","bald","thin"]),
+    ("color",           ["color","colour","fade","brassy","grey","gray","dye"]),
+    ("oily",            ["oil","greasy","grease","sebum","buildup"]),
+    ("dry",             ["dry","frizz","rough","brittle","moisture","parched"]),
+    ("tangly",          ["tangl","knot","matted","detangle"]),
+    ("flat/volume",     ["flat","volume","lifeless","limp","fine","no bounce"]),
+]
+
 def extract_concern(text):
     t = text.lower()
-    if any(w in t for w in ["damag","break","weak","fall","shed","bald","thin"]): return "damaged/falling"
-    if any(w in t for w in ["color","colour","fade","brassy","grey","gray","dye"]): return "color"
-    if any(w in t for w in ["oil","greasy","grease","sebum","buildup"]): return "oily"
-    if any(w in t for w in ["dry","frizz","rough","brittle","moisture","parched"]): return "dry"
-    if any(w in t for w in ["tangl","knot","matted","detangle"]): return "tangly"
-    if any(w in t for w in ["flat","volume","lifeless","limp","fine","no bounce"]): return "flat/volume"
+    for concern, words in CONCERN_KEYWORDS:
+        if any(w in t for w in words): return concern
     return "general"
 
+# ── OUTBOUND HTTP (keep-alive connection pools per host) ─────────────────────
+import http.client, urllib.parse, urllib.error, io, select
+
+HTTP_DEFAULT_TIMEOUT = float(os.environ.get("HTTP_DEFAULT_TIMEOUT", "15"))
+# Parked connections idle longer than this are dropped rather than reused;
+# servers commonly close keep-alive sockets after ~5–60s of silence.
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "4"))
+HTTP_MAX_RETRIES     = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+HTTP_RETRY_STATUSES  = {429, 500, 502, 503, 504, 529}
+# Statuses that mean the request was turned away unprocessed — safe to retry
+# even for a POST. The rest of HTTP_RETRY_STATUSES (and a connection dropped
+# after the request was sent) are only retried for idempotent requests.
+HTTP_UNPROCESSED_STATUSES = {429, 503, 529}
+HTTP_IDEMPOTENT_METHODS   = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Max in-flight requests per host; anything not listed gets HTTP_DEFAULT_HOST_LIMIT.
+HTTP_HOST_LIMITS = {
+    "api.anthropic.com": 64,
+    "api.openai.com":    16,
+    "api.stripe.com":    8,
+}
+HTTP_DEFAULT_HOST_LIMIT = 8
+
+class _HostPool:
+    """Idle keep-alive connections plus an in-flight limit for one scheme://host:port."""
+
+    def __init__(self, scheme, host, port, limit, max_idle=8):
+        self.scheme, self.host, self.port = scheme, host, port
+        self.slots    = threading.BoundedSemaphore(limit)
+        self.max_idle = max_idle
+        self._idle    = []              # [(connection, parked_at)]
+        self._lock    = threading.Lock()
+
+    def get(self, timeout):
+        """Return (connection, reused) — a live idle connection if one is parked,
+        else a new one."""
+        while True:
+            with self._lock:
+                con, parked_at = self._idle.pop() if self._idle else (None, 0)
+            if con is None:
+                break
+            if time.monotonic() - parked_at < HTTP_KEEPALIVE_SECONDS and self._alive(con):
+                con.timeout = timeout
+                con.sock.settimeout(timeout)
+                return con, True
+            con.close()
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout), False
+
+    @staticmethod
+    def _alive(con):
+        """An idle socket should have nothing to read; readable means the
+        server closed it (EOF) or sent something we never asked for."""
+        if con.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([con.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def put(self, con):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((con, time.monotonic()))
+                return
+        con.close()
+
+_http_pools      = {}
+_http_pools_lock = threading.Lock()
+
+def _host_pool(scheme, host, port):
+    key = (scheme, host, port)
+    pool = _http_pools.get(key)
+    if pool is None:
+        with _http_pools_lock:
+            pool = _http_pools.get(key)
+            if pool is None:
+                limit = HTTP_HOST_LIMITS.get(host, HTTP_DEFAULT_HOST_LIMIT)
+                pool = _http_pools[key] = _HostPool(scheme, host, port, limit)
+    return pool
+
+class HTTPClientResponse:
+    """Response from http_request(). Read it (read/json/iterate lines) or close it;
+    either way the connection goes back to its host pool when the body is done."""
+
+    def __init__(self, url, pool, con, resp):
+        self.url, self.status, self.reason = url, resp.status, resp.reason
+        self.headers = resp.headers
+        self._pool, self._con, self._resp = pool, con, resp
+        self._released = False
+
+    def read(self):
+        try:
+            return self._resp.read()
+        finally:
+            self.close()
+
+    def json(self):
+        return json.loads(self.read().decode("utf-8"))
+
+    def text(self, errors="strict"):
+        return self.read().decode("utf-8", errors=errors)
+
+    def __iter__(self):
+        try:
+            while True:
+                line = self._resp.readline()
+                if not line: break
+                yield line
+        finally:
+            self.close()
+
+    def close(self):
+        if self._released: return
+        self._released = True
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._pool.put(self._con)
+        else:
+            self._con.close()
+        self._pool.slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def _retry_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring a (capped) Retry-After."""
+    if retry_after:
+        try: return min(float(retry_after), 10.0)
+        except ValueError: pass
+    return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+def http_request(method, url, data=None, headers=None, timeout=None,
+                 retries=None, raise_for_status=True, max_redirects=5):
+    """Send an HTTP request over a pooled keep-alive connection.
+
+    Retries 429/5xx (and dropped connections) with jittered backoff, follows
+    redirects, and raises urllib.error.HTTPError for 4xx/5xx like urlopen does
+    unless raise_for_status=False. Always close the response or read it fully.
+
+    A POST/PATCH is only retried when it cannot have been processed (refused
+    or dropped before it was fully sent, 429/503/529), unless it carries an
+    Idempotency-Key header.
+    """
+    timeout = timeout or HTTP_DEFAULT_TIMEOUT
+    retries = HTTP_MAX_RETRIES if retries is None else retries
+    headers = {"User-Agent": "SupportRD-HairAdvisor/1.0", **(headers or {})}
+    attempt = 0
+    while True:
+        safe  = method in HTTP_IDEMPOTENT_METHODS or any(k.lower() == "idempotency-key" for k in headers)
+        parts = urllib.parse.urlsplit(url)
+        port  = parts.port or (443 if parts.scheme == "https" else 80)
+        path  = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        pool  = _host_pool(parts.scheme, parts.hostname, port)
+        if not pool.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"too many concurrent requests to {parts.hostname}")
+        con, reused = pool.get(timeout)
+        sent = False
+        try:
+            con.request(method, path, body=data, headers=headers)
+            sent = True
+            resp = con.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                ConnectionRefusedError) as e:
+            con.close(); pool.slots.release()
+            if reused and (not sent or isinstance(e, http.client.RemoteDisconnected)):
+                # Stale keep-alive socket closed before any response byte:
+                # the server never took the request, so retry at once
+                continue
+            if sent and not safe:
+                raise urllib.error.URLError(e)   # the server may have acted on it
+            if attempt < retries:
+                time.sleep(_retry_delay(attempt)); attempt += 1
+                continue
+            raise urllib.error.URLError(e)
+        except Exception:
+            con.close(); pool.slots.release()
+            raise
+        result = HTTPClientResponse(url, pool, con, resp)
+
+        if resp.status in (301, 302, 303, 307, 308) and max_redirects and resp.headers.get("Location"):
+            result.read()
+            url = urllib.parse.urljoin(url, resp.headers["Location"])
+            if resp.status == 303 or (resp.status in (301, 302) and method == "POST"):
+                method, data = "GET", None
+            max_redirects -= 1
+            continue
+        if (resp.status in HTTP_RETRY_STATUSES and attempt < retries
+                and (safe or resp.status in HTTP_UNPROCESSED_STATUSES)):
+            retry_after = resp.headers.get("Retry-After")
+            result.read()
+            time.sleep(_retry_delay(attempt, retry_after)); attempt += 1
+            continue
+        if raise_for_status and resp.status >= 400:
+            body = result.read()
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+        return result
+
+def anthropic_request(payload, timeout=12):
+    """POST to the Anthropic Messages API over the shared keep-alive pool."""
+    return http_request("POST", "https://api.anthropic.com/v1/messages",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={
+            "Content-Type": "application/json",
+            "x-api-key": ANTHROPIC_API_KEY,
+            "anthropic-version": "2023-06-01"
+        },
+        timeout=timeout)
+
+
 # ── SYSTEM PROMPT ─────────────────────────────────────────────────────────────
 SYSTEM_PROMPT = """You are Aria — a warm, knowledgeable, luxury hair care advisor for SupportRD, a professional Dominican hair care brand. You have deep expertise in hair science, scalp health, and hair culture across all ethnicities.
 
@@ -263,8 +1035,124 @@ Respond ONLY with your answer. No preamble. No "Sure!" or "Of course!".
 If the language code indicates non-English, respond entirely in that language."""
 
 
+# ── PRE-RENDERED PAGES (fixed HTML encoded once: identity, gzip, brotli) ──────
+import functools, gzip
+
+PAGE_MAX_AGE  = int(os.environ.get("PAGE_MAX_AGE", "3600"))
+ASSET_MAX_AGE = 31536000   # fingerprinted URLs never change content
+# Absolute, because the index page is also served on the shop's domain through
+# the Shopify app proxy, where a root-relative /static/ would hit the storefront
+ASSET_BASE_URL = os.environ.get("APP_BASE_URL", "https://ai-hair-advisor.onrender.com").rstrip("/")
+
+def compress_variants(body, brotli_quality=11):
+    """{content-coding: bytes} for one body — gzip always, brotli when the
+    optional `brotli` module is installed."""
+    variants = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+    try:
+        import brotli
+        variants["br"] = brotli.compress(body, quality=brotli_quality)
+    except ImportError:
+        pass
+    return variants
+
+def negotiated_response(variants, etag, mimetype="text/html", max_age=PAGE_MAX_AGE, private=False,
+                        last_modified=None, immutable=False):
+    """Serve the best encoding the client accepts, with a strong ETag per
+    encoding, Vary: Accept-Encoding and a 304 for a matching conditional GET."""
+    accept   = request.accept_encodings
+    encoding = next((e for e in ("br", "gzip") if e in variants and accept[e]), "identity")
+    resp = Response(variants[encoding], mimetype=mimetype)
+    if encoding != "identity":
+        resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag if encoding == "identity" else f"{etag}-{encoding}")
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.vary.add("Accept-Encoding")
+    if private:
+        resp.cache_control.private = True
+    else:
+        resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    if immutable:
+        resp.cache_control.immutable = True
+    return resp.make_conditional(request)
+
+# ── STATIC BUNDLES (inline CSS/JS → minified, content-hashed /static files) ───
+STATIC_ASSETS = {}   # file name → {"variants", "etag", "mimetype"}
+
+# One pass over the stylesheet: quoted strings are matched first and kept
+# verbatim, so comments and whitespace are only touched outside of them
+_CSS_TOKEN_RE    = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')"""
+                              r"|(/\*.*?\*/)|\s*;\s*(\})\s*|\s*([{};,>])\s*|\s+", re.S)
+_INLINE_ASSET_RE = re.compile(r"<style>(.*?)</style>|<script>(.*?)</script>", re.S)
+
+def _css_token(m):
+    string, comment, close, punct = m.groups()
+    if string:
+        return string
+    if comment:
+        return ""
+    return close or punct or " "
+
+def minify_css(css):
+    return _CSS_TOKEN_RE.sub(_css_token, css).strip()
+
+def register_asset(stem, ext, source):
+    """Fingerprint one bundle and return its absolute /static URL. CSS is
+    minified; JS is kept verbatim (a line-based JS minifier cannot tell
+    comments, strings and regexes apart safely) and relies on gzip/brotli."""
+    body   = (minify_css(source) if ext == "css" else source).encode("utf-8")
+    digest = hashlib.sha1(body).hexdigest()
+    name   = f"{stem}.{digest[:12]}.{ext}"
+    STATIC_ASSETS[name] = {
+        "variants": compress_variants(body),
+        "etag":     digest,
+        "mimetype": "text/css" if ext == "css" else "application/javascript",
+    }
+    return f"{ASSET_BASE_URL}/static/{name}"
+
+def externalize_assets(html, stem):
+    """Move each attribute-less inline <style>/<script> block into its own
+    bundle, referenced from the same spot so cascade and execution order
+    are unchanged."""
+    n = 0
+    def swap(m):
+        nonlocal n
+        n += 1
+        if m.group(1) is not None:
+            return f'<link rel="stylesheet" href="{register_asset(f"{stem}-{n}", "css", m.group(1))}">'
+        return f'<script src="{register_asset(f"{stem}-{n}", "js", m.group(2))}"></script>'
+    return _INLINE_ASSET_RE.sub(swap, html)
+
+@app.route("/static/<filename>")
+def static_asset(filename):
+    asset = STATIC_ASSETS.get(filename)
+    if not asset:
+        return "Not found", 404
+    return negotiated_response(asset["variants"], asset["etag"], asset["mimetype"],
+                               max_age=ASSET_MAX_AGE, immutable=True)
+
+def prerendered(view=None, *, private=False, assets=None):
+    """Render a view that returns fixed HTML once, at import, and serve the
+    stored bytes from then on. Use only on views whose output never depends
+    on the request. With `assets`, its inline CSS/JS is split out into
+    /static bundles named after it."""
+    if view is None:
+        return lambda v: prerendered(v, private=private, assets=assets)
+    html     = view()
+    body     = (externalize_assets(html, assets) if assets else html).encode("utf-8")
+    variants = compress_variants(body)
+    etag     = hashlib.sha1(body).hexdigest()
+
+    @functools.wraps(view)
+    def serve(*args, **kwargs):
+        return negotiated_response(variants, etag, private=private)
+    return serve
+
+
 # ── MAIN APP ──────────────────────────────────────────────────────────────────
 @app.route("/")
+@prerendered(assets="index")
 def index():
     return r"""<!DOCTYPE html>
 <html>
@@ -1380,6 +2268,99 @@ function localRecommend(text) {
   return R.default;
 }
 
+/* ── STREAMING RECOMMENDATION (SSE) ── */
+// Speaks sentences as they arrive; end() fires the outro/tip once the last one finishes.
+function createSpeechQueue(showTip) {
+  let started = false, finished = false, pending = 0;
+  function done() {
+    playAmbient("outro");
+    setState("idle"); setColor(...IDLE);
+    stateLabel.textContent = "Tap to begin";
+    if (showTip) {
+      setTimeout(() => openTipPanel(lastRecommendedProduct), 1200);
+    }
+  }
+  return {
+    push(sentence) {
+      sentence = sentence.trim();
+      if (!sentence) return;
+      if (!started) {
+        started = true;
+        speechSynthesis.cancel();
+        setState("speaking"); setColor(...SPEAK);
+        stateLabel.textContent = "Speaking";
+      }
+      const utter = new SpeechSynthesisUtterance(sentence);
+      utter.lang  = langSelect.value;
+      utter.voice = getBestVoice(langSelect.value);
+      utter.rate  = 0.88; utter.pitch = 1.05;
+      pending++;
+      utter.onend = () => { pending--; if (finished && pending === 0) done(); };
+      speechSynthesis.speak(utter);
+    },
+    end() { finished = true; if (started && pending === 0) done(); },
+    get started() { return started; }
+  };
+}
+
+const SENTENCE_RE = /^[\s\S]*?(?:[.!?…]+(?=\s)|[。！？])/;
+
+async function streamRecommendation(userText, onSentence) {
+  const controller = new AbortController();
+  // Only the wait for the FIRST token is bounded — once words flow we keep them.
+  const firstToken = setTimeout(() => controller.abort(), 6000);
+  const headers = {"Content-Type": "application/json", "Accept": "text/event-stream", "X-Session-Id": SESSION_ID};
+  if(window._srd_token) headers["X-Auth-Token"] = window._srd_token;
+  let text = "", pending = "";
+  try {
+    const resp = await fetch("https://ai-hair-advisor.onrender.com/api/recommend/stream", {
+      method: "POST",
+      headers: headers,
+      body: JSON.stringify({
+        text: userText,
+        lang: langSelect.value,
+        history: conversationHistory.slice(0, -1)
+      }),
+      signal: controller.signal
+    });
+    if (!resp.ok || !resp.body) throw new Error("not ok");
+    const reader  = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buf.indexOf("\n\n")) >= 0) {
+        const frame = buf.slice(0, idx);
+        buf = buf.slice(idx + 2);
+        if (!frame.startsWith("data:")) continue;
+        const msg = JSON.parse(frame.slice(5));
+        if (msg.error) throw new Error(msg.error);
+        if (msg.done) { handleSubscriptionResponse(msg); continue; }
+        if (!msg.delta) continue;
+        clearTimeout(firstToken);
+        text    += msg.delta;
+        pending += msg.delta;
+        responseBox.textContent = text;
+        let m;
+        while ((m = pending.match(SENTENCE_RE))) {
+          onSentence(m[0]);
+          pending = pending.slice(m[0].length);
+        }
+      }
+    }
+  } catch(e) {
+    clearTimeout(firstToken);
+    // Nothing arrived. If we gave up waiting, the server may still be working
+    // on this turn, so the caller must not post it again.
+    if (!text) { e.timedOut = controller.signal.aborted; throw e; }
+  }
+  if (pending.trim()) onSentence(pending);
+  return text.trim();
+}
+
 /* ── AI RECOMMENDATION ── */
 async function getRecommendation(userText) {
   try {
@@ -1425,7 +2406,21 @@ async function processText(text) {
   responseBox.textContent = "Thinking…";
   stateLabel.textContent  = "Thinking";
 
-  const result = await getRecommendation(text);
+  // Stream first so speech starts on the first sentence. If the stream fails
+  // outright, fall back to the one-shot endpoint (then local answers); if it
+  // timed out waiting for the first token, answer locally — re-posting would
+  // run the model twice and could record the turn twice.
+  const speech = createSpeechQueue(true);
+  let streamed = null, timedOut = false;
+  try { streamed = await streamRecommendation(text, s => speech.push(s)); }
+  catch(e) { timedOut = !!e.timedOut; }
+  if (streamed) {
+    addToHistory("assistant", streamed);
+    speech.end();
+    return;
+  }
+
+  const result = timedOut ? null : await getRecommendation(text);
   const final  = result || localRecommend(text);
 
   addToHistory("assistant", final);
@@ -1663,130 +2658,587 @@ async function goUpgrade(){
 # ── API: RECOMMEND (WITH SUBSCRIPTION GATING) ────────────────────────────────
 FREE_SYSTEM_PROMPT = """You are Aria, a hair care advisor for SupportRD. Give ONE brief, helpful product recommendation in 2 sentences max. Mention the product name and price. End every response with: "For deeper hair analysis, personalized advice, and your full hair health score, upgrade to SupportRD Premium — start free for 7 days." Keep it warm and helpful."""
 
-@app.route("/api/recommend", methods=["POST","OPTIONS"])
-def recommend():
-    data       = request.get_json()
-    user_text  = data.get("text", "")
-    lang       = data.get("lang", "en-US")
-    history    = data.get("history", [])
-    session_id = request.headers.get("X-Session-Id", request.remote_addr or "anon")
+LANG_NAMES = {
+    "en-US":"English","es-ES":"Spanish","fr-FR":"French",
+    "pt-BR":"Portuguese","de-DE":"German","ar-SA":"Arabic",
+    "zh-CN":"Mandarin Chinese","hi-IN":"Hindi"
+}
 
-    # Check user + subscription
-    user       = get_current_user()
-    subscribed = is_subscribed(user["id"]) if user else False
+# ── PROMPT ASSEMBLY (cacheable system prompt, history token budget) ─────────
+RECOMMEND_MODEL             = "claude-sonnet-4-20250514"
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.environ.get("PROMPT_HISTORY_TOKEN_BUDGET", "1200"))
+PROMPT_SUMMARY_CHARS        = int(os.environ.get("PROMPT_SUMMARY_CHARS", "600"))
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 chars per token) — good enough for budgeting."""
+    return len(text or "") // 4 + 4
+
+def system_blocks(static, dynamic=""):
+    """System prompt as content blocks. The static prompt is identical on every
+    call, so it is marked cacheable; the per-user tail comes after the breakpoint."""
+    blocks = [{"type": "text", "text": static, "cache_control": {"type": "ephemeral"}}]
+    if dynamic.strip():
+        blocks.append({"type": "text", "text": dynamic.strip()})
+    return blocks
+
+def summarize_turns(turns, max_chars=PROMPT_SUMMARY_CHARS):
+    """Extractive summary of dropped turns: what the client asked, the concerns
+    it touched on and the products already suggested."""
+    asks, concerns, products = [], [], []
+    for t in turns:
+        if t["role"] == "user":
+            first = re.split(r"(?<=[.!?])\s+", t["content"].strip(), 1)[0]
+            asks.append(first[:120])
+            concern = extract_concern(t["content"])
+            if concern != "general" and concern not in concerns:
+                concerns.append(concern)
+        else:
+            product = extract_product(t["content"])
+            if product != "Unknown" and product not in products:
+                products.append(product)
+    lines = []
+    if concerns: lines.append("Concerns raised: " + ", ".join(concerns))
+    if products: lines.append("Products already suggested: " + ", ".join(products))
+    if asks:     lines.append("Client asked: " + " | ".join(asks[-5:]))
+    return "\n".join(lines)[:max_chars]
+
+def budget_history(turns, budget=PROMPT_HISTORY_TOKEN_BUDGET):
+    """Keep the newest turns that fit in `budget` tokens. Returns (kept, dropped);
+    kept always starts with a user turn, as the Messages API requires."""
+    kept, used = [], 0
+    for t in reversed(turns):
+        cost = estimate_tokens(t["content"])
+        if used + cost > budget:
+            break
+        kept.append(t); used += cost
+    kept.reverse()
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    return kept, turns[:len(turns) - len(kept)]
+
+def assemble_prompt(static, dynamic, turns, user_text, budget=PROMPT_HISTORY_TOKEN_BUDGET):
+    """Build system blocks + messages for one call, trimming history oldest-first."""
+    turns = [{"role": t["role"], "content": t["content"]} for t in turns
+             if t.get("role") in ("user","assistant") and t.get("content")]
+    kept, dropped = budget_history(turns, budget)
+    if dropped:
+        summary = summarize_turns(dropped)
+        if summary:
+            dynamic += "\n\nEARLIER IN THIS CONVERSATION (summary):\n" + summary
+    return {
+        "system":        system_blocks(static, dynamic),
+        "messages":      kept + [{"role": "user", "content": user_text}],
+        "history_turns": len(kept),
+        "dropped_turns": len(dropped),
+    }
 
-    lang_names = {
-        "en-US":"English","es-ES":"Spanish","fr-FR":"French",
-        "pt-BR":"Portuguese","de-DE":"German","ar-SA":"Arabic",
-        "zh-CN":"Mandarin Chinese","hi-IN":"Hindi"
+def record_llm_usage(endpoint, model, usage, history_turns=0, dropped_turns=0):
+    """Store the token counts the API reported for one call in analytics.db."""
+    if not usage:
+        return
+    ANALYTICS_WRITER.submit("""INSERT INTO llm_usage (ts,endpoint,model,input_tokens,output_tokens,
+            cache_read_tokens,cache_write_tokens,history_turns,dropped_turns)
+        VALUES (?,?,?,?,?,?,?,?,?)""",
+        (datetime.datetime.utcnow().isoformat(), endpoint, model,
+         usage.get("input_tokens") or 0, usage.get("output_tokens") or 0,
+         usage.get("cache_read_input_tokens") or 0, usage.get("cache_creation_input_tokens") or 0,
+         history_turns, dropped_turns))
+
+def llm_usage_report():
+    row = ANALYTICS_POOL.read("""SELECT COUNT(*), SUM(input_tokens), SUM(output_tokens),
+            SUM(cache_read_tokens), SUM(cache_write_tokens), SUM(dropped_turns)
+        FROM llm_usage""", fetchone=True)
+    calls, inp, out, cache_read, cache_write, dropped = [v or 0 for v in row]
+    prompt_total = inp + cache_read + cache_write
+    return {
+        "calls":              calls,
+        "input_tokens":       inp,
+        "output_tokens":      out,
+        "cache_read_tokens":  cache_read,
+        "cache_write_tokens": cache_write,
+        "prompt_cache_ratio": round(cache_read / prompt_total, 3) if prompt_total else 0.0,
+        "avg_prompt_tokens":  round(prompt_total / calls, 1) if calls else 0.0,
+        "dropped_turns":      dropped,
     }
-    lang_name  = lang_names.get(lang, "English")
+
+# ── CONVERSATION SUMMARIES (older turns folded into one row per user) ───────
+CHAT_SUMMARY_KEEP      = int(os.environ.get("CHAT_SUMMARY_KEEP_MESSAGES", "4"))  # last two exchanges stay verbatim
+CHAT_SUMMARY_BATCH     = int(os.environ.get("CHAT_SUMMARY_BATCH", "4"))
+CHAT_SUMMARY_MAX_CHARS = int(os.environ.get("CHAT_SUMMARY_MAX_CHARS", "1200"))
+SUMMARY_MODEL          = os.environ.get("SUMMARY_MODEL", "claude-3-5-haiku-20241022")
+
+SUMMARY_PROMPT = """You keep a running summary of a client's conversations with Aria, SupportRD's hair care advisor. Merge the new turns into the existing summary. Keep hair type, concerns, treatments, products tried or recommended, results the client reported and personal details that matter for hair advice. Drop small talk. At most 120 words, plain sentences.
+Respond ONLY with the updated summary."""
+
+_summary_queue   = queue.Queue()
+_summary_pending = set()
+_summary_lock    = threading.Lock()
+
+def queue_chat_summary(user_id):
+    """Ask the background summarizer to look at this user (deduplicated)."""
+    with _summary_lock:
+        if user_id in _summary_pending:
+            return
+        _summary_pending.add(user_id)
+    _summary_queue.put(user_id)
+
+def summarize_with_model(previous, turns):
+    """Merge `turns` into the `previous` summary; falls back to an extractive
+    summary when the model is unavailable."""
+    if ANTHROPIC_API_KEY:
+        transcript = "\n".join(f"{t['role'].upper()}: {t['content']}" for t in turns)
+        payload = {
+            "model": SUMMARY_MODEL,
+            "max_tokens": 300,
+            "system": SUMMARY_PROMPT,
+            "messages": [{"role": "user", "content":
+                f"EXISTING SUMMARY:\n{previous or '(none)'}\n\nNEW TURNS:\n{transcript}"}]
+        }
+        try:
+            result = anthropic_request(payload, timeout=30).json()
+            record_llm_usage("chat-summary", SUMMARY_MODEL, result.get("usage"))
+            return result["content"][0]["text"].strip()[:CHAT_SUMMARY_MAX_CHARS]
+        except Exception as e:
+            print("Chat summary model error:", e)
+    merged = ((previous or "") + "\n" + summarize_turns(turns)).strip()
+    return merged[-CHAT_SUMMARY_MAX_CHARS:]
+
+def fold_chat_summary(user_id):
+    """Fold every turn older than the last CHAT_SUMMARY_KEEP messages into the
+    user's summary row, once at least CHAT_SUMMARY_BATCH of them have piled up."""
+    row = USERS_POOL.read("SELECT summary, last_message_id FROM chat_summaries WHERE user_id=?",
+                          (user_id,), fetchone=True)
+    previous, last_id = (row[0], row[1]) if row else ("", 0)
+    rows = USERS_POOL.read("""SELECT id, role, content FROM chat_history
+        WHERE user_id=? AND id>? ORDER BY id""", (user_id, last_id))
+    if len(rows) < CHAT_SUMMARY_KEEP + CHAT_SUMMARY_BATCH:
+        return False
+    fold    = rows[:-CHAT_SUMMARY_KEEP]
+    summary = summarize_with_model(previous, [{"role": r[1], "content": r[2]} for r in fold])
+    with USERS_POOL.transaction() as con:
+        # History cleared while we were summarizing: don't resurrect it
+        if not con.execute("SELECT 1 FROM chat_history WHERE id=?", (fold[-1][0],)).fetchone():
+            return False
+        con.execute("""INSERT INTO chat_summaries (user_id, summary, last_message_id, updated_at)
+            VALUES (?,?,?,datetime('now')) ON CONFLICT(user_id) DO UPDATE SET
+            summary=excluded.summary, last_message_id=excluded.last_message_id,
+            updated_at=excluded.updated_at
+            WHERE excluded.last_message_id > chat_summaries.last_message_id""",
+            (user_id, summary, fold[-1][0]))
+    return True
+
+def _chat_summary_worker():
+    # Pick up anyone who fell behind while the app was down
+    try:
+        for (user_id,) in USERS_POOL.read("""SELECT h.user_id FROM chat_history h
+                LEFT JOIN chat_summaries cs ON cs.user_id=h.user_id
+                WHERE h.id > COALESCE(cs.last_message_id, 0)
+                GROUP BY h.user_id HAVING COUNT(*) >= ?""",
+                (CHAT_SUMMARY_KEEP + CHAT_SUMMARY_BATCH,)):
+            queue_chat_summary(user_id)
+    except Exception as e:
+        print("Chat summary sweep error:", e)
+    while True:
+        user_id = _summary_queue.get()
+        with _summary_lock:
+            _summary_pending.discard(user_id)
+        try:
+            fold_chat_summary(user_id)
+        except Exception as e:
+            print("Chat summary error:", e)
+
+background_thread(_chat_summary_worker)
+
+# ── REQUEST CONTEXT (one read at the start, one write at the end) ────────────
+RECOMMEND_HISTORY_TURNS = 15
+
+def load_request_context(token, session_id, history_limit=RECOMMEND_HISTORY_TURNS):
+    """Fetch user, session validity, subscription, hair profile, the conversation
+    summary, the chat turns not yet folded into it (at most `history_limit`)
+    and the usage counter in a single query."""
+    row = USERS_POOL.read("""SELECT u.id, u.email, u.name, u.avatar,
+            sub.status, sub.plan, sub.trial_end, sub.current_period_end,
+            hp.hair_type, hp.hair_concerns, hp.treatments, hp.products_tried,
+            CASE WHEN u.id IS NOT NULL
+                 THEN (SELECT count FROM session_usage WHERE user_id=u.id)
+                 ELSE (SELECT count FROM session_usage WHERE session_id=t.session_id AND user_id IS NULL)
+            END,
+            (SELECT json_group_array(json_array(id, role, content)) FROM
+                (SELECT id, role, content FROM chat_history
+                 WHERE user_id=u.id AND id > COALESCE(cs.last_message_id, 0)
+                 ORDER BY id DESC LIMIT ?)),
+            cs.summary
+        FROM (SELECT ? AS token, ? AS session_id) t
+        LEFT JOIN sessions s ON s.token=t.token AND s.expires_at > datetime('now')
+        LEFT JOIN users u ON u.id=s.user_id
+        LEFT JOIN subscriptions sub ON sub.user_id=u.id
+        LEFT JOIN hair_profiles hp ON hp.user_id=u.id
+        LEFT JOIN chat_summaries cs ON cs.user_id=u.id""",
+        (history_limit, token or "", session_id), fetchone=True)
+
+    ctx = {"user": None, "subscription": None, "subscribed": False, "profile": {},
+           "history": [], "summary": row[14] or "", "usage_count": row[12] or 0,
+           "session_id": session_id}
+    if row[0] is None:
+        return ctx
+    ctx["user"] = {"id":row[0],"email":row[1],"name":row[2],"avatar":row[3]}
+    if row[4] is not None:
+        ctx["subscription"] = {"status":row[4],"plan":row[5],"trial_end":row[6],"current_period_end":row[7]}
+    ctx["subscribed"] = subscription_active(ctx["subscription"])
+    if any(v is not None for v in row[8:12]):
+        ctx["profile"] = {"hair_type":row[8],"hair_concerns":row[9],"treatments":row[10],"products_tried":row[11]}
+    turns = sorted(json.loads(row[13] or "[]"))
+    ctx["history"] = [{"role":role,"content":content} for _id, role, content in turns]
+    return ctx
+
+def commit_request_context(ctx, chat=(), concern=None):
+    """Write everything a request produced in one transaction: chat messages,
+    the profile concern update and the usage counter."""
+    user = ctx["user"]
+    with USERS_POOL.transaction() as con:
+        if user:
+            for role, content in chat:
+                _insert_chat_message(con, user["id"], role, content)
+            if concern and ctx["subscribed"]:
+                profile  = ctx["profile"]
+                existing = profile.get("hair_concerns") or ""
+                if concern not in existing:
+                    updated = (existing + ", " + concern).strip(", ")
+                    _upsert_hair_profile(con, user["id"], {**profile, "hair_concerns": updated})
+        _bump_session_count(con, ctx["session_id"], user["id"] if user else None)
+    ctx["usage_count"] += 1
+    if user and chat and ctx["subscribed"]:
+        queue_chat_summary(user["id"])
+
+def prepare_recommendation(data, token, session_id):
+    """Load the request context and assemble the model request for a recommend call."""
+    user_text = data.get("text", "")
+    lang      = data.get("lang", "en-US")
+    history   = data.get("history", [])
+    ctx       = load_request_context(token, session_id)
+    user, subscribed = ctx["user"], ctx["subscribed"]
+
+    lang_name  = LANG_NAMES.get(lang, "English")
     lang_instr = f"\n\nIMPORTANT: Your ENTIRE response must be in {lang_name}."
 
     # ── EVERYONE gets full Aria — premium gets saved history + profile context
-    show_paywall  = False
     profile_context = ""
-    if user:
-        if subscribed:
-            profile = get_hair_profile(user["id"])
-            if profile.get("hair_type") or profile.get("hair_concerns"):
-                profile_context = f"""
+    if user and subscribed:
+        profile = ctx["profile"]
+        if profile.get("hair_type") or profile.get("hair_concerns"):
+            profile_context = f"""
 
 RETURNING CLIENT PROFILE:
-- Name: {user.get("name","this client")}
-- Hair type: {profile.get("hair_type","unknown")}
-- Known concerns: {profile.get("hair_concerns","none saved")}
-- Treatments history: {profile.get("treatments","none saved")}
-- Products tried: {profile.get("products_tried","none saved")}
+- Name: {user.get("name") or "this client"}
+- Hair type: {profile.get("hair_type") or "unknown"}
+- Known concerns: {profile.get("hair_concerns") or "none saved"}
+- Treatments history: {profile.get("treatments") or "none saved"}
+- Products tried: {profile.get("products_tried") or "none saved"}
 Reference this naturally in your response."""
-        save_chat_message(user["id"], "user", user_text)
-    active_prompt = SYSTEM_PROMPT + profile_context + lang_instr
-    max_tokens    = 350
+
+    summary_context = ""
+    if user and subscribed and ctx["summary"]:
+        summary_context = "\n\nCONVERSATION SO FAR (summary of earlier turns):\n" + ctx["summary"]
+
+    if subscribed and user:
+        turns = ctx["history"]
+    else:
+        # Free users only get last 1 exchange for context
+        turns = history[-2:]
+    prompt = assemble_prompt(SYSTEM_PROMPT, profile_context + summary_context + lang_instr, turns, user_text)
+
+    return {
+        "ctx":           ctx,
+        "user_text":     user_text,
+        "lang":          lang,
+        "system":        prompt["system"],
+        "messages":      prompt["messages"],
+        "history_turns": prompt["history_turns"],
+        "dropped_turns": prompt["dropped_turns"],
+        "max_tokens":    350,
+        # First question with no personal context: the answer depends only on text + lang
+        "cacheable":     (len(prompt["messages"]) == 1 and not profile_context
+                          and not summary_context and not prompt["dropped_turns"]),
+    }
+
+def recommend_payload(plan):
+    return {
+        "model": RECOMMEND_MODEL,
+        "max_tokens": plan["max_tokens"],
+        "system": plan["system"],
+        "messages": plan["messages"]
+    }
+
+def finish_recommendation(plan, recommendation, usage=None, endpoint="recommend"):
+    """Persist the turn (one users.db transaction + analytics event) and build the JSON body.
+    `usage` is the API's token usage for the call, None when served from the response cache."""
+    ctx, user_text = plan["ctx"], plan["user_text"]
+    user, subscribed = ctx["user"], ctx["subscribed"]
+
+    # Save history + auto-update profile for subscribers
+    chat = [("user", user_text)] if user else []
+    if subscribed and user:
+        chat.append(("assistant", recommendation))
+    commit_request_context(ctx, chat=chat, concern=extract_concern(user_text))
+
+    product = extract_product(recommendation)
+    concern = extract_concern(user_text)
+    log_event(plan["lang"], user_text, product, concern)
+    record_llm_usage(endpoint, RECOMMEND_MODEL, usage, plan["history_turns"], plan["dropped_turns"])
+
+    return {
+        "recommendation":  recommendation,
+        "logged_in":       user is not None,
+        "user_name":       user["name"] if user else None,
+        "subscribed":      subscribed,
+        "response_count":  ctx["usage_count"],
+        "free_limit":      FREE_RESPONSE_LIMIT,
+        "show_paywall":    False,
+        "paywall_soft":    True
+    }
+
+# ── RESPONSE CACHE (repeat first questions from anonymous/free users) ────────
+
+PROMPT_VERSION            = hashlib.sha1((SYSTEM_PROMPT + FREE_SYSTEM_PROMPT).encode("utf-8")).hexdigest()[:12]
+RESPONSE_CACHE_TTL        = int(os.environ.get("RESPONSE_CACHE_TTL", str(6 * 3600)))
+RESPONSE_CACHE_SIZE       = int(os.environ.get("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0.75"))
+
+_CACHE_STOPWORDS = {"a","an","the","my","i","is","are","am","and","or","it","its","me","so",
+                    "very","really","of","to","for","with","what","should","do","can","you"}
+
+def normalize_question(text):
+    t = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(t.split())
+
+class ResponseCache:
+    """TTL + LRU cache of model answers keyed on (prompt version, lang, normalized text).
+
+    Misses on the exact key fall back to a similarity tier: entries that share
+    the `extract_concern` bucket are compared by Jaccard overlap of their
+    content words, so "my hair is dry and frizzy" reuses "dry, frizzy hair".
+    """
+
+    def __init__(self, ttl, max_entries, similarity):
+        self.ttl, self.max_entries, self.similarity = ttl, max_entries, similarity
+        self._entries = OrderedDict()   # key -> (answer, words, bucket, expires)
+        self._buckets = {}              # bucket -> {key: words}
+        self._lock    = threading.Lock()
+        self.stats    = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "bypassed": 0}
+
+    @staticmethod
+    def keys(text, lang):
+        norm   = normalize_question(text)
+        bucket = (PROMPT_VERSION, lang, extract_concern(norm))
+        words  = frozenset(w for w in norm.split() if w not in _CACHE_STOPWORDS)
+        return (PROMPT_VERSION, lang, norm), bucket, words
+
+    def get(self, text, lang):
+        key, bucket, words = self.keys(text, lang)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[3] > now:
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return entry[0]
+            best, best_score = None, self.similarity
+            for other, other_words in self._buckets.get(bucket, {}).items():
+                union = len(words | other_words)
+                score = len(words & other_words) / union if union else 0
+                if score >= best_score and self._entries[other][3] > now:
+                    best, best_score = other, score
+            if best is not None:
+                self._entries.move_to_end(best)
+                self.stats["similar_hits"] += 1
+                return self._entries[best][0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, text, lang, answer):
+        key, bucket, words = self.keys(text, lang)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (answer, words, bucket, time.time() + self.ttl)
+            self._buckets.setdefault(bucket, {})[key] = words
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            members = self._buckets.get(entry[2], {})
+            members.pop(key, None)
+            if not members: self._buckets.pop(entry[2], None)
+
+    def bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def report(self):
+        with self._lock:
+            s = dict(self.stats)
+            size = len(self._entries)
+        lookups = s["exact_hits"] + s["similar_hits"] + s["misses"]
+        hits    = s["exact_hits"] + s["similar_hits"]
+        return {**s, "entries": size, "prompt_version": PROMPT_VERSION,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_SIMILARITY)
+
+def cached_recommendation(plan):
+    """Cached answer for `plan`, or None. Personalized or follow-up turns never hit the cache."""
+    if not plan["cacheable"]:
+        RESPONSE_CACHE.bypass()
+        return None
+    return RESPONSE_CACHE.get(plan["user_text"], plan["lang"])
+
+def remember_recommendation(plan, recommendation):
+    if plan["cacheable"] and recommendation:
+        RESPONSE_CACHE.put(plan["user_text"], plan["lang"], recommendation)
+
+@app.route("/api/recommend/cache-stats", methods=["GET"])
+def recommend_cache_stats():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    return jsonify(RESPONSE_CACHE.report())
+
+@app.route("/api/recommend/usage-stats", methods=["GET"])
+def recommend_usage_stats():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    return jsonify(llm_usage_report())
+
+
+@app.route("/api/recommend", methods=["POST","OPTIONS"])
+def recommend():
+    data       = request.get_json(silent=True)
+    session_id = request.headers.get("X-Session-Id", request.remote_addr or "anon")
+    if not isinstance(data, dict):
+        return jsonify({"recommendation": None, "error": "Invalid JSON body"}), 400
 
     if not ANTHROPIC_API_KEY:
         return jsonify({"recommendation": None, "error": "No API key"}), 500
 
     try:
-        import urllib.request as urlreq
-
-        # Build messages
-        messages = []
-        if subscribed and user:
-            db_history = get_chat_history(user["id"], limit=16)
-            for h in db_history[:-1]:
-                if h.get("role") in ("user","assistant") and h.get("content"):
-                    messages.append({"role": h["role"], "content": h["content"]})
-        else:
-            # Free users only get last 1 exchange for context
-            for h in history[-2:]:
-                if h.get("role") in ("user","assistant") and h.get("content"):
-                    messages.append({"role": h["role"], "content": h["content"]})
-
-        messages.append({"role": "user", "content": user_text})
-
-        payload = json.dumps({
-            "model": "claude-sonnet-4-20250514",
-            "max_tokens": max_tokens,
-            "system": active_prompt,
-            "messages": messages
-        }).encode("utf-8")
+        plan = prepare_recommendation(data, request_auth_token(), session_id)
 
-        req = urlreq.Request(
-            "https://api.anthropic.com/v1/messages",
-            data=payload,
-            headers={
-                "Content-Type": "application/json",
-                "x-api-key": ANTHROPIC_API_KEY,
-                "anthropic-version": "2023-06-01"
-            },
-            method="POST"
-        )
-        with urlreq.urlopen(req, timeout=12) as resp:
-            result    = json.loads(resp.read().decode("utf-8"))
+        usage = None
+        recommendation = cached_recommendation(plan)
+        if recommendation is None:
+            result = anthropic_request(recommend_payload(plan), timeout=12).json()
             recommendation = result["content"][0]["text"].strip()
+            usage = result.get("usage")
+            remember_recommendation(plan, recommendation)
 
-        # Save history + auto-update profile for subscribers
-        if subscribed and user:
-            save_chat_message(user["id"], "assistant", recommendation)
-            concern = extract_concern(user_text)
-            if concern:
-                profile  = get_hair_profile(user["id"])
-                existing = profile.get("hair_concerns","")
-                if concern not in existing:
-                    updated = (existing + ", " + concern).strip(", ")
-                    save_hair_profile(user["id"], {**profile, "hair_concerns": updated})
+        return jsonify(finish_recommendation(plan, recommendation, usage))
 
-        # Increment usage counter
-        increment_session_count(session_id, user["id"] if user else None)
-        new_count = count + 1
+    except Exception as e:
+        return jsonify({"recommendation": None, "error": str(e)}), 500
 
-        product = extract_product(recommendation)
-        concern = extract_concern(user_text)
-        log_event(lang, user_text, product, concern)
 
-        return jsonify({
-            "recommendation":  recommendation,
-            "logged_in":       user is not None,
-            "user_name":       user["name"] if user else None,
-            "subscribed":      subscribed,
-            "response_count":  new_count,
-            "free_limit":      FREE_RESPONSE_LIMIT,
-            "show_paywall":    show_paywall,
-            "paywall_soft":    True
-        })
+# ── API: RECOMMEND (STREAMING, SERVER-SENT EVENTS) ───────────────────────────
+def stream_anthropic(payload, timeout=12, usage=None):
+    """POST a streaming Messages request and yield text deltas as they arrive.
+
+    `timeout` bounds each socket read, not the whole completion, so a long
+    answer keeps flowing as long as the model keeps producing tokens. Token
+    usage reported by the stream is merged into the `usage` dict if given.
+    """
+    with anthropic_request({**payload, "stream": True}, timeout=timeout) as resp:
+        for raw in resp:
+            delta = anthropic_sse_delta(raw.decode("utf-8"), usage)
+            if delta is STREAM_END:
+                break
+            if delta:
+                yield delta
+
+STREAM_END = object()
+
+def anthropic_sse_delta(line, usage=None):
+    """Parse one line of an Anthropic SSE stream: text delta, STREAM_END, or None.
+    Usage from message_start / message_delta events is merged into `usage`."""
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    event = json.loads(line[5:])
+    kind  = event.get("type")
+    if usage is not None:
+        if kind == "message_start":
+            usage.update(event.get("message", {}).get("usage") or {})
+        elif kind == "message_delta":
+            usage.update(event.get("usage") or {})
+    if kind == "content_block_delta" and event["delta"].get("type") == "text_delta":
+        return event["delta"]["text"]
+    if kind == "error":
+        raise RuntimeError(event.get("error", {}).get("message", "stream error"))
+    if kind == "message_stop":
+        return STREAM_END
+    return None
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
 
+@app.route("/api/recommend/stream", methods=["POST","OPTIONS"])
+def recommend_stream():
+    """Same contract as /api/recommend, but model tokens are forwarded as SSE
+    `{"delta": ...}` events and the usual JSON body arrives last as `{"done": true, ...}`."""
+    data       = request.get_json(silent=True)
+    session_id = request.headers.get("X-Session-Id", request.remote_addr or "anon")
+    if not isinstance(data, dict):
+        return jsonify({"recommendation": None, "error": "Invalid JSON body"}), 400
+
+    if not ANTHROPIC_API_KEY:
+        return jsonify({"recommendation": None, "error": "No API key"}), 500
+
+    try:
+        plan = prepare_recommendation(data, request_auth_token(), session_id)
     except Exception as e:
         return jsonify({"recommendation": None, "error": str(e)}), 500
 
+    def generate():
+        # If the client disconnects, the server closes this generator at the
+        # next yield (GeneratorExit): the model stream is closed by its `with`
+        # and finish_recommendation never runs, so nothing is persisted.
+        parts, usage = [], {}
+        try:
+            cached = cached_recommendation(plan)
+            if cached is not None:
+                parts.append(cached)
+                yield sse_event({"delta": cached})
+            else:
+                for delta in stream_anthropic(recommend_payload(plan), usage=usage):
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+                remember_recommendation(plan, "".join(parts).strip())
+            body = finish_recommendation(plan, "".join(parts).strip(), usage, "recommend/stream")
+            yield sse_event({"done": True, **body})
+        except Exception as e:
+            yield sse_event({"error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 # ── API: TIP LOGGING ──────────────────────────────────────────────────────────
 @app.route("/api/tip", methods=["POST"])
 def tip():
-    data    = request.get_json()
-    lang    = data.get("lang", "en-US")
-    rating  = data.get("rating", 0)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
+    lang    = data.get("lang") or "en-US"
+    rating  = data.get("rating") or 0
     amount  = data.get("amount", "skip")
-    product = data.get("product", "")
+    product = data.get("product") or ""
+    # rating is stored as an integer, amount as text ("$5", "skip", or a number)
+    try:
+        rating = int(rating)
+    except (TypeError, ValueError):
+        return jsonify({"error": "rating must be a number"}), 400
+    if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+        amount = str(amount)
+    if rating < 0 or not all(isinstance(v, str) for v in (lang, amount, product)):
+        return jsonify({"error": "invalid tip"}), 400
     log_tip(lang, rating, amount, product)
     return jsonify({"ok": True})
 
@@ -1794,6 +3246,219 @@ def tip():
 # ── ANALYTICS DASHBOARD ───────────────────────────────────────────────────────
 ANALYTICS_KEY = os.environ.get("ANALYTICS_KEY", "hairadmin")
 
+@app.route("/api/analytics/writer-stats", methods=["GET"])
+def analytics_writer_stats():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    return jsonify(ANALYTICS_WRITER.report())
+
+# ── ANALYTICS SERIES API (JSON time series from the rollups, streamed) ──────
+SERIES_METRICS   = ("events", "product", "concern", "lang", "tips", "tip_amount", "rating")
+SERIES_INTERVALS = {"day": 10, "hour": 13}      # bucket = ts[:n]
+_SERIES_TS_RE    = re.compile(r"^\d{4}-\d{2}-\d{2}(T\d{2}(:\d{2}(:\d{2}(\.\d+)?)?)?)?$")
+
+def series_range(interval, start, end):
+    """Normalize ?from/?to to bucket bounds for `interval` (inclusive).
+    Defaults: the last 30 days for day buckets, the last 48 hours for hour buckets."""
+    width = SERIES_INTERVALS[interval]
+    now   = datetime.datetime.utcnow()
+    if not end:
+        end = now.isoformat()
+    if not start:
+        span  = datetime.timedelta(days=30) if interval == "day" else datetime.timedelta(hours=48)
+        start = (now - span).isoformat()
+    for value in (start, end):
+        if not _SERIES_TS_RE.match(value):
+            raise ValueError(f"Bad timestamp {value!r} — use YYYY-MM-DD or YYYY-MM-DDTHH")
+    if len(end) == 10:
+        end += "T23"    # a bare date as the upper bound means "through the end of that day"
+    return start[:width], end[:width]
+
+def stream_json(head, key, chunks):
+    """Yield `head` as a JSON object whose `key` is an array built from row chunks."""
+    yield json.dumps(head)[:-1] + f', "{key}": ['
+    first = True
+    for chunk in chunks:
+        yield ("" if first else ",") + ",".join(json.dumps(row) for row in chunk)
+        first = False
+    yield "]}"
+
+@app.route("/api/analytics/series", methods=["GET"])
+def analytics_series():
+    """?metric=product[,concern…]&interval=day|hour&from=&to= → per-bucket counts:
+    {"series": [{"metric", "bucket", "key", "n", "total"}, ...]} ordered by metric, bucket."""
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    interval = request.args.get("interval", "day")
+    metrics  = [m for m in request.args.get("metric", "events").split(",") if m]
+    if interval not in SERIES_INTERVALS or not metrics or any(m not in SERIES_METRICS for m in metrics):
+        return jsonify({"error": f"interval: {sorted(SERIES_INTERVALS)}; metric: {list(SERIES_METRICS)}"}), 400
+    try:
+        start, end = series_range(interval, request.args.get("from"), request.args.get("to"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def chunks():
+        for metric in metrics:
+            for rows in ANALYTICS_POOL.iterate("""SELECT bucket, key, n, total FROM rollups
+                    WHERE period=? AND metric=? AND bucket BETWEEN ? AND ?
+                    ORDER BY bucket, key""", (interval, metric, start, end)):
+                yield [{"metric": metric, "bucket": r[0], "key": r[1], "n": r[2], "total": r[3]} for r in rows]
+
+    head = {"interval": interval, "from": start, "to": end, "metrics": metrics}
+    return Response(stream_json(head, "series", chunks()), mimetype="application/json")
+
+@app.route("/api/analytics/events", methods=["GET"])
+def analytics_events():
+    """?from=&to= → raw events in a time range, oldest first, streamed.
+    Only rows still in analytics.db; archived ones are read with scan_archive()."""
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    try:
+        start, end = series_range("hour", request.args.get("from"), request.args.get("to"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    end_ts = end + "\uffff"    # include every timestamp inside the last hour
+
+    def chunks():
+        for rows in ANALYTICS_POOL.iterate("""SELECT ts, lang, user_msg, product, concern FROM events
+                WHERE ts >= ? AND ts < ? ORDER BY ts""", (start, end_ts)):
+            yield [{"ts": r[0], "lang": r[1], "user_msg": r[2], "product": r[3], "concern": r[4]} for r in rows]
+
+    return Response(stream_json({"from": start, "to": end}, "events", chunks()), mimetype="application/json")
+
+# ── ANALYTICS ARCHIVE (old raw rows → date-partitioned columnar files) ───────
+# Rollups already hold the counts for archived rows, so /analytics totals and
+# /api/analytics/series are unaffected; only the raw rows leave analytics.db.
+ANALYTICS_ARCHIVE_DIR  = os.environ.get("ANALYTICS_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "analytics_archive"))
+ANALYTICS_ARCHIVE_DAYS = int(os.environ.get("ANALYTICS_ARCHIVE_DAYS", "90"))
+ARCHIVE_TABLES         = ("events", "tips")
+
+def _archive_format():
+    """'parquet' when pyarrow is installed, else 'ndjson.gz'."""
+    try:
+        import pyarrow, pyarrow.parquet
+        return "parquet"
+    except ImportError:
+        return "ndjson.gz"
+
+def _write_partition(table, day, columns, rows, fmt):
+    """Write one day's rows to <dir>/<table>/date=<day>/part-<first id>-<last id>.<fmt>.
+    Named by id range, so re-archiving the same rows overwrites instead of duplicating."""
+    folder = os.path.join(ANALYTICS_ARCHIVE_DIR, table, f"date={day}")
+    os.makedirs(folder, exist_ok=True)
+    ids  = [r[0] for r in rows]
+    path = os.path.join(folder, f"part-{min(ids)}-{max(ids)}.{fmt}")
+    tmp  = path + ".tmp"
+    if fmt == "parquet":
+        import pyarrow, pyarrow.parquet
+        data = pyarrow.table({c: [r[i] for r in rows] for i, c in enumerate(columns)})
+        pyarrow.parquet.write_table(data, tmp, compression="zstd")
+    else:
+        import gzip
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(dict(zip(columns, r))) + "\n")
+    os.replace(tmp, path)
+    return path
+
+def archive_analytics(days=None):
+    """Move events/tips rows older than `days` into the archive, one file per
+    table per day. Rows are deleted only after their files are on disk."""
+    days   = ANALYTICS_ARCHIVE_DAYS if days is None else days
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).date().isoformat()
+    fmt    = _archive_format()
+    report = {"cutoff": cutoff, "format": fmt, "tables": {}}
+    for table in ARCHIVE_TABLES:
+        max_id = ANALYTICS_POOL.read(f"SELECT MAX(id) FROM {table} WHERE ts < ?", (cutoff,), fetchone=True)[0]
+        if max_id is None:
+            report["tables"][table] = {"rows": 0, "files": []}
+            continue
+        cur     = ANALYTICS_POOL.connection().execute(f"SELECT * FROM {table} LIMIT 0")
+        columns = [d[0] for d in cur.description]
+        files, count, day, pending = [], 0, None, []
+        for rows in ANALYTICS_POOL.iterate(f"SELECT * FROM {table} WHERE ts < ? AND id <= ? ORDER BY ts",
+                                           (cutoff, max_id)):
+            for r in rows:
+                if r[1][:10] != day and pending:
+                    files.append(_write_partition(table, day, columns, pending, fmt))
+                    pending = []
+                day = r[1][:10]
+                pending.append(tuple(r))
+                count += 1
+        if pending:
+            files.append(_write_partition(table, day, columns, pending, fmt))
+        with ANALYTICS_POOL.transaction() as con:
+            con.execute(f"DELETE FROM {table} WHERE ts < ? AND id <= ?", (cutoff, max_id))
+        report["tables"][table] = {"rows": count, "files": files}
+    return report
+
+def scan_archive(table="events", start=None, end=None, columns=None, where=None):
+    """Yield archived rows as dicts for ad-hoc analysis.
+    `start`/`end` are inclusive YYYY-MM-DD partition bounds, `columns` limits the
+    fields read, `where` is an optional predicate on each row dict."""
+    root = os.path.join(ANALYTICS_ARCHIVE_DIR, table)
+    if not os.path.isdir(root):
+        return
+    for part in sorted(os.listdir(root)):
+        day = part.partition("=")[2]
+        if (start and day < start) or (end and day > end):
+            continue
+        for name in sorted(os.listdir(os.path.join(root, part))):
+            path = os.path.join(root, part, name)
+            if name.endswith(".parquet"):
+                import pyarrow.parquet
+                rows = pyarrow.parquet.read_table(path, columns=columns).to_pylist()
+            elif name.endswith(".ndjson.gz"):
+                import gzip
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    rows = [json.loads(line) for line in f]
+                if columns:
+                    rows = [{c: r.get(c) for c in columns} for r in rows]
+            else:
+                continue
+            for row in rows:
+                if where is None or where(row):
+                    yield row
+
+def _archive_locked(days=None):
+    """Run archive_analytics unless another worker already is (non-blocking file lock)."""
+    import fcntl
+    os.makedirs(ANALYTICS_ARCHIVE_DIR, exist_ok=True)
+    with open(os.path.join(ANALYTICS_ARCHIVE_DIR, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+        return archive_analytics(days)
+
+def _archive_scheduler():
+    time.sleep(3600)    # stay out of the way of startup
+    while True:
+        try:
+            report = _archive_locked()
+            if report:
+                print("🗄️ Analytics archived:", {t: r["rows"] for t, r in report["tables"].items()})
+        except Exception as e:
+            print("Analytics archive error:", e)
+        time.sleep(86400)
+
+background_thread(_archive_scheduler)
+
+@app.route("/api/admin/archive-analytics", methods=["POST"])
+def admin_archive_analytics():
+    """Run the archive job now. ?days= overrides ANALYTICS_ARCHIVE_DAYS."""
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    try:
+        days = int(request.args.get("days", ANALYTICS_ARCHIVE_DAYS))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    report = _archive_locked(days)
+    if report is None:
+        return jsonify({"error": "Archive already running"}), 409
+    return jsonify(report)
+
 @app.route("/analytics")
 def analytics():
     key = request.args.get("key", "")
@@ -1801,21 +3466,23 @@ def analytics():
         return "Unauthorized. Add ?key=YOUR_ANALYTICS_KEY to the URL.", 401
 
     try:
-        con = get_analytics_db()
-        total    = con.execute("SELECT COUNT(*) FROM events").fetchone()[0]
-        products = con.execute("SELECT product, COUNT(*) as n FROM events GROUP BY product ORDER BY n DESC").fetchall()
-        concerns = con.execute("SELECT concern, COUNT(*) as n FROM events GROUP BY concern ORDER BY n DESC").fetchall()
-        langs    = con.execute("SELECT lang, COUNT(*) as n FROM events GROUP BY lang ORDER BY n DESC").fetchall()
-        recent   = con.execute("SELECT ts, lang, user_msg, product, concern FROM events ORDER BY id DESC LIMIT 50").fetchall()
+        # Totals come from the rollups; only the recent tail touches the events table
+        total    = rollup_count("events")
+        products = rollup_totals("product")
+        concerns = rollup_totals("concern")
+        langs    = rollup_totals("lang")
+        recent   = ANALYTICS_POOL.read("SELECT ts, lang, user_msg, product, concern FROM events ORDER BY id DESC LIMIT 50")
         # Tip stats
-        tip_total   = con.execute("SELECT COUNT(*) FROM tips").fetchone()[0]
-        avg_rating  = con.execute("SELECT AVG(rating) FROM tips WHERE rating > 0").fetchone()[0]
-        tip_amounts = con.execute("SELECT tip_amount, COUNT(*) as n FROM tips GROUP BY tip_amount ORDER BY n DESC").fetchall()
+        tip_total   = rollup_count("tips")
+        rating      = rollup_totals("rating")
+        avg_rating  = rating[0][2] / rating[0][1] if rating and rating[0][1] else None
+        tip_amounts = rollup_totals("tip_amount")
         avg_r = round(avg_rating, 2) if avg_rating else "N/A"
-        con.close()
     except Exception as e:
         return f"DB error: {e}", 500
 
+    cache_rate = f"{RESPONSE_CACHE.report()['hit_rate'] * 100:.0f}%"
+
     def bar(n, total):
         pct = int((n / total * 36)) if total else 0
         return "█" * pct + "░" * (36 - pct)
@@ -1864,6 +3531,7 @@ def analytics():
 <div class="stat"><div class="n">{len(langs)}</div><div class="l">Languages Used</div></div>
 <div class="stat"><div class="n">{tip_total}</div><div class="l">Tip Submissions</div></div>
 <div class="stat"><div class="n">{avg_r}</div><div class="l">Avg Star Rating</div></div>
+<div class="stat"><div class="n">{cache_rate}</div><div class="l">Answer Cache Hit Rate</div></div>
 
 <h2>Product Recommendations</h2>
 <table><tr><th>Product</th><th>Count</th><th>Share</th><th>%</th></tr>{prod_rows}</table>
@@ -1988,10 +3656,9 @@ def reset_password():
     if expires and datetime.datetime.utcnow().isoformat() > expires:
         return jsonify({"error":"Reset link has expired. Please request a new one."}), 400
 
-    import hashlib
-    hashed = hashlib.sha256(password.encode()).hexdigest()
-    db_execute("UPDATE users SET password=?, reset_token=NULL, reset_token_expires=NULL WHERE id=?",
-               (hashed, user[0]))
+    db_execute("UPDATE users SET password_hash=?, reset_token=NULL, reset_token_expires=NULL WHERE id=?",
+               (hash_password(password), user[0]))
+    SESSION_CACHE.invalidate(user_id=user[0])
     return jsonify({"ok": True})
 
 
@@ -2042,15 +3709,19 @@ def _start_content_scheduler():
     t = threading.Thread(target=scheduler, daemon=True)
     t.start()
 
-_start_content_scheduler()
+background(_start_content_scheduler)
 
 
 
 # ── BLOG DATABASE (SQLite — persists across restarts) ─────────────────────────
-BLOG_DB = "/data/srd_blog.db"
+BLOG_DB = os.environ.get("BLOG_DB", "/data/srd_blog.db")
+BLOG_POOL = SQLitePool(BLOG_DB, timeout=10, row_factory=sqlite3.Row)
+
+def get_blog_db():
+    return _PooledConnection(BLOG_POOL)
 
 def _init_blog_db():
-    db = sqlite3.connect(BLOG_DB)
+    db = get_blog_db()
     db.execute("""CREATE TABLE IF NOT EXISTS posts (
         handle TEXT PRIMARY KEY,
         title TEXT,
@@ -2065,36 +3736,135 @@ def _init_blog_db():
 
 _init_blog_db()
 
+BLOG_MIGRATIONS = [
+    ("posts by date", ["CREATE INDEX IF NOT EXISTS idx_posts_date ON posts(date)"]),
+    # Keyset listing: (date, handle) orders and seeks, title/meta make it
+    # covering so a listing page never reads the table (or its html)
+    ("posts listing", ["CREATE INDEX IF NOT EXISTS idx_posts_listing ON posts(date, handle, title, meta)",
+                       "DROP INDEX IF EXISTS idx_posts_date"]),
+    # A NULL date compares as NULL against a cursor, so those posts fell out
+    # of every page after the first; blog_save_post now stores '' instead
+    ("posts without date", ["UPDATE posts SET date='' WHERE date IS NULL"]),
+]
+
+BLOG_POOL.migrate(BLOG_MIGRATIONS)
+
+BLOG_PAGE_SIZE  = int(os.environ.get("BLOG_PAGE_SIZE", "30"))
+BLOG_API_LIMIT  = 90     # default page for /api/blog-posts (the old fixed cap)
+BLOG_LIST_FIRST = "SELECT handle, title, meta, date FROM posts ORDER BY date DESC, handle DESC LIMIT ?"
+BLOG_LIST_AFTER = """SELECT handle, title, meta, date FROM posts WHERE (date, handle) < (?, ?)
+    ORDER BY date DESC, handle DESC LIMIT ?"""
+
+# ── QUERY PLAN CHECK (hot queries must stay on an index) ──────────────────────
+HOT_QUERIES = [
+    (USERS_POOL, "session → user", """SELECT u.id,u.email,u.name,u.avatar FROM users u
+        JOIN sessions s ON s.user_id=u.id WHERE s.token=? AND s.expires_at > datetime('now')""", ("x",)),
+    (USERS_POOL, "chat history", "SELECT role,content FROM chat_history WHERE user_id=? ORDER BY id DESC LIMIT ?", (1, 20)),
+    (USERS_POOL, "usage by user", "SELECT count FROM session_usage WHERE user_id=?", (1,)),
+    (USERS_POOL, "usage by session", "SELECT count FROM session_usage WHERE session_id=? AND user_id IS NULL", ("x",)),
+    (USERS_POOL, "subscription by customer", "SELECT user_id FROM subscriptions WHERE stripe_customer=?", ("x",)),
+    (USERS_POOL, "password reset", "SELECT id, reset_token_expires FROM users WHERE reset_token=?", ("x",)),
+    (ANALYTICS_POOL, "rollup totals", "SELECT key, n, total FROM rollups WHERE period=? AND bucket=? AND metric=?",
+     ("all", "", "product")),
+    (ANALYTICS_POOL, "rollup series", """SELECT bucket, key, n, total FROM rollups
+        WHERE period=? AND metric=? AND bucket BETWEEN ? AND ? ORDER BY bucket, key""",
+     ("day", "product", "2026-01-01", "2026-01-31")),
+    (ANALYTICS_POOL, "events by time", "SELECT ts, lang, user_msg, product, concern FROM events WHERE ts >= ? AND ts < ? ORDER BY ts",
+     ("2026-01-01", "2026-01-02")),
+    (BLOG_POOL, "blog listing", BLOG_LIST_FIRST, (30,)),
+    (BLOG_POOL, "blog listing after cursor", BLOG_LIST_AFTER, ("2026-01-01", "x", 30)),
+    (BLOG_POOL, "blog post", "SELECT * FROM posts WHERE handle=?", ("x",)),
+    (BLOG_POOL, "sitemap", "SELECT handle, date FROM posts ORDER BY date, handle", ()),
+]
+
+# Hot queries that walk an index from one end on purpose: the first listing
+# page (bounded by its LIMIT) and the sitemap (every post, by design)
+INTENTIONAL_SCANS = {"blog listing", "sitemap"}
+
+def plan_regressions(name, plan):
+    """The steps of an EXPLAIN QUERY PLAN that make a hot query regressed:
+    any temp b-tree sort, and any SCAN — unless the query is listed in
+    INTENTIONAL_SCANS and the scan reads a covering index."""
+    return [p for p in plan if p.startswith("USE TEMP B-TREE")
+            or (p.startswith("SCAN") and not (name in INTENTIONAL_SCANS and "COVERING INDEX" in p))]
+
+def check_query_plans():
+    """EXPLAIN QUERY PLAN every hot query (tests/test_query_plans.py runs this)."""
+    results = []
+    for pool, name, query, params in HOT_QUERIES:
+        plan = [r[3] for r in pool.read("EXPLAIN QUERY PLAN " + query, params)]
+        results.append({"query": name, "plan": plan, "ok": not plan_regressions(name, plan)})
+    return results
+
+@app.route("/api/admin/query-plans", methods=["GET"])
+def admin_query_plans():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    results = check_query_plans()
+    ok = all(r["ok"] for r in results)
+    return jsonify({"ok": ok, "queries": results}), 200 if ok else 500
+
 def blog_save_post(post):
-    db = sqlite3.connect(BLOG_DB)
-    db.execute("""INSERT OR REPLACE INTO posts
+    BLOG_POOL.write("""INSERT OR REPLACE INTO posts
         (handle, title, html, meta, chinese_title, chinese_summary, date)
         VALUES (?,?,?,?,?,?,?)""",
         (post.get("handle"), post.get("title"), post.get("html"),
          post.get("meta",""), post.get("chinese_title",""),
-         post.get("chinese_summary",""), post.get("date","")))
-    db.commit()
-    db.close()
+         post.get("chinese_summary",""), post.get("date") or ""))
+    BLOG_PAGES.invalidate(post.get("handle"))
+    SITEMAP.invalidate()
 
-def blog_get_index(limit=90):
-    db = sqlite3.connect(BLOG_DB)
-    rows = db.execute("SELECT handle, title, meta, date FROM posts ORDER BY date DESC LIMIT ?", (limit,)).fetchall()
-    db.close()
-    return [{"handle":r[0],"title":r[1],"meta":r[2],"date":r[3]} for r in rows]
+def encode_blog_cursor(post):
+    raw = json.dumps([post["date"] or "", post["handle"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_blog_cursor(cursor):
+    """(date, handle) from a cursor; ValueError if it was not one of ours."""
+    try:
+        date, handle = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("bad cursor")
+    if not isinstance(date, str) or not isinstance(handle, str):
+        raise ValueError("bad cursor")
+    return date, handle
+
+def blog_get_page(limit, cursor=None):
+    """Post summaries (never the html column), newest first, `limit` at a time
+    starting after `cursor`. Returns (posts, next_cursor or None). Raises
+    ValueError for a malformed cursor."""
+    if cursor:
+        rows = BLOG_POOL.read(BLOG_LIST_AFTER, (*decode_blog_cursor(cursor), limit + 1))
+    else:
+        rows = BLOG_POOL.read(BLOG_LIST_FIRST, (limit + 1,))
+    posts = [dict(r) for r in rows[:limit]]
+    return posts, (encode_blog_cursor(posts[-1]) if len(rows) > limit else None)
 
 def blog_get_post(handle):
-    db = sqlite3.connect(BLOG_DB)
-    row = db.execute("SELECT handle, title, html, meta, chinese_title, chinese_summary, date FROM posts WHERE handle=?", (handle,)).fetchone()
-    db.close()
-    if not row: return None
-    return {"handle":row[0],"title":row[1],"html":row[2],"meta":row[3],
-            "chinese_title":row[4],"chinese_summary":row[5],"date":row[6]}
+    try:
+        row = BLOG_POOL.read("SELECT handle, title, html, meta, chinese_title, chinese_summary, date FROM posts WHERE handle=?",
+                             (handle,), fetchone=True)
+        return dict(row) if row else None
+    except Exception as e:
+        print(f"blog_get_post error: {e}")
+        return None
 
 # ── BLOG API ENDPOINTS (for auto-engine to fetch) ────────────────────────────
 @app.route("/api/blog-posts", methods=["GET"])
 def api_blog_posts():
-    """Return list of all blog posts as JSON."""
-    return jsonify(blog_get_index())
+    """Return one page of blog post summaries as a JSON array, newest first.
+    ?limit= (max 500) and ?cursor=; the cursor for the next page is in the
+    X-Next-Cursor header and a Link rel="next", absent on the last page."""
+    limit = max(1, min(request.args.get("limit", BLOG_API_LIMIT, type=int), 500))
+    try:
+        posts, next_cursor = blog_get_page(limit, request.args.get("cursor") or None)
+    except ValueError:
+        return jsonify({"error": "bad cursor"}), 400
+    resp = jsonify(posts)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+        resp.headers["Link"] = f'</api/blog-posts?limit={limit}&cursor={next_cursor}>; rel="next"'
+        resp.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor, Link"
+    return resp
 
 @app.route("/api/blog-post/<handle>", methods=["GET"])
 def api_blog_post(handle):
@@ -2107,105 +3877,324 @@ def api_blog_post(handle):
 
 # ── PUBLIC BLOG ───────────────────────────────────────────────────
 
-@app.route("/api/hair-trends")
-def hair_trends():
-    """Scrape trending hair content from multiple platforms."""
-    import re, urllib.request, urllib.parse, random, threading
-    results = []
-    lock = threading.Lock()
+# ── TREND INGESTION (each source scraped on its own schedule, served from memory) ─
 
-    def scrape_reddit():
-        try:
-            url = "https://www.reddit.com/r/Hair+Haircare+NaturalHair+curlyhair/hot.json?limit=12"
-            req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-            with urllib.request.urlopen(req, timeout=8) as r:
-                data = json.loads(r.read().decode())
-            posts = data["data"]["children"]
-            for p in posts[:8]:
-                d = p["data"]
-                title = d.get("title","")
-                if any(kw in title.lower() for kw in ["hair","curl","scalp","growth","damage","frizz","moisture"]):
-                    img = d.get("thumbnail","")
-                    if img and img.startswith("http"):
-                        with lock:
-                            results.append({"title": title, "image": img, "source": "reddit", "link": "https://reddit.com" + d.get("permalink","")})
-        except Exception as e:
-            print(f"Reddit scrape error: {e}")
+TREND_KEYWORDS = ["hair", "curl", "scalp", "growth", "damage", "frizz", "moisture", "routine"]
+TREND_KEYWORD_RE  = re.compile("|".join(map(re.escape, TREND_KEYWORDS)), re.IGNORECASE)
+TREND_BROWSER_UA  = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36"
+TREND_BLOG_LINK   = "https://auto-engine.onrender.com/blog"
+TREND_RETRY_SECONDS = float(os.environ.get("TREND_RETRY_SECONDS", "30"))
+TREND_MAX_AGE       = int(os.environ.get("TREND_MAX_AGE", "60"))
+TREND_FIXTURE_DIR   = os.environ.get("TREND_FIXTURE_DIR", "")   # set to record raw scrape bodies
+
+class TrendSource:
+    """One place trends come from: fetch → parse → filter → normalize.
+
+    fetch() is the only step that touches the network; it returns the variant
+    it asked for (a search query, a tag) and the raw body. The rest is pure, so
+    a body recorded under TREND_FIXTURE_DIR replays through extract() offline
+    and bench_trend_sources() can time it. Adding a source is a subclass with
+    a name, fetch() and parse(); patterns are compiled once, on the class.
+    """
+    name     = None
+    interval = 600      # seconds between refreshes (TREND_REFRESH_<NAME> overrides)
+    keep     = 40       # items held in TrendStore
+    limit    = None     # items taken from one refresh
+
+    def __init__(self):
+        self.interval = float(os.environ.get(f"TREND_REFRESH_{self.name.upper()}", self.interval))
+        self._lock    = threading.Lock()
+        self.stats    = {"runs": 0, "errors": 0, "items": 0, "fetch_ms": 0.0, "parse_ms": 0.0}
+
+    def fetch(self, run):
+        raise NotImplementedError
 
-    def scrape_pinterest():
+    def parse(self, raw, variant):
+        raise NotImplementedError
+
+    def keep_item(self, item):
+        return bool(TREND_KEYWORD_RE.search(item["title"]))
+
+    def normalize(self, item, variant):
+        return {**item, "source": self.name}
+
+    def extract(self, raw, variant):
+        items = [self.normalize(item, variant) for item in self.parse(raw, variant) if self.keep_item(item)]
+        return items[:self.limit]
+
+    def collect(self, run):
+        """One refresh. Raises on failure, after counting it."""
+        started = time.perf_counter()
         try:
-            queries = ["hair care routine", "natural hair", "curly hair tips", "hair growth"]
-            query = random.choice(queries)
-            url = f"https://pinterest.com/search/pins/?q={urllib.parse.quote(query)}"
-            req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36"})
-            with urllib.request.urlopen(req, timeout=8) as r:
-                html = r.read().decode("utf-8", errors="ignore")
-            images = re.findall(r'"url":"(https://i\.pinimg\.com/[^"]+736[^"]+\.jpg)"', html)
-            titles = re.findall(r'"title":"([^"]{15,100})"', html)
-            hair_titles = [t for t in titles if any(kw in t.lower() for kw in ["hair","curl","scalp","growth","damage","frizz"])]
-            for i, img in enumerate(images[:6]):
-                with lock:
-                    results.append({"title": hair_titles[i] if i < len(hair_titles) else query, "image": img, "source": "pinterest", "link": "https://auto-engine.onrender.com/blog"})
-        except Exception as e:
-            print(f"Pinterest scrape error: {e}")
+            variant, raw = self.fetch(run)
+            fetched = time.perf_counter()
+            if TREND_FIXTURE_DIR:
+                record_trend_fixture(self.name, variant, raw)
+            items = self.extract(raw, variant)
+        except Exception:
+            with self._lock:
+                self.stats["runs"]   += 1
+                self.stats["errors"] += 1
+            raise
+        done = time.perf_counter()
+        with self._lock:
+            self.stats["runs"]     += 1
+            self.stats["items"]    += len(items)
+            self.stats["fetch_ms"] += (fetched - started) * 1000
+            self.stats["parse_ms"] += (done - fetched) * 1000
+        return items
+
+    def report(self):
+        with self._lock:
+            s = dict(self.stats)
+        ok = s["runs"] - s["errors"]
+        return {
+            "runs":          s["runs"],
+            "errors":        s["errors"],
+            "error_rate":    round(s["errors"] / s["runs"], 3) if s["runs"] else 0.0,
+            "items_per_run": round(s["items"] / ok, 1) if ok else 0,
+            "avg_fetch_ms":  round(s["fetch_ms"] / ok, 1) if ok else None,
+            "avg_parse_ms":  round(s["parse_ms"] / ok, 3) if ok else None,
+        }
 
-    def scrape_tumblr():
+class RedditTrends(TrendSource):
+    name, interval, keep = "reddit", 600, 40
+    URL = "https://www.reddit.com/r/Hair+Haircare+NaturalHair+curlyhair/hot.json?limit=12"
+
+    def fetch(self, run):
+        return "hot", http_request("GET", self.URL, headers={"User-Agent": "Mozilla/5.0"}, timeout=8).text()
+
+    def parse(self, raw, variant):
+        for p in json.loads(raw)["data"]["children"][:8]:
+            d = p["data"]
+            yield {"title": d.get("title", ""), "image": d.get("thumbnail", ""),
+                   "link": "https://reddit.com" + d.get("permalink", "")}
+
+    def keep_item(self, item):
+        return bool(item["image"] and item["image"].startswith("http")) and super().keep_item(item)
+
+class PinterestTrends(TrendSource):
+    name, interval, keep, limit = "pinterest", 900, 96, 12
+    QUERIES  = ["hair care routine", "natural hair", "curly hair tips", "hair growth",
+                "hair growth tips", "damaged hair repair", "curly hair", "hair loss treatment"]
+    IMAGE_RE = re.compile(r'"url"\s*:\s*"(https://i\.pinimg\.com/[^"]+736[^"]+\.jpg)"')
+    TITLE_RE = re.compile(r'"title"\s*:\s*"([^"]{15,100})"')
+
+    def fetch(self, run):
+        # One search per refresh, rotating through the queries
+        query = self.QUERIES[run % len(self.QUERIES)]
+        url = f"https://pinterest.com/search/pins/?q={urllib.parse.quote(query)}&rs=typed"
+        return query, http_request("GET", url, headers={"User-Agent": TREND_BROWSER_UA,
+                                                        "Accept-Language": "en-US,en;q=0.9"},
+                                   timeout=10).text(errors="ignore")
+
+    def parse(self, raw, variant):
+        # Pins carry no usable title of their own: pair images with the
+        # hair-related titles on the page, falling back to the query
+        titles = [t for t in self.TITLE_RE.findall(raw) if TREND_KEYWORD_RE.search(t)]
+        for i, img in enumerate(self.IMAGE_RE.findall(raw)[:self.limit]):
+            yield {"title": titles[i] if i < len(titles) else variant, "image": img, "link": TREND_BLOG_LINK}
+
+    def keep_item(self, item):
+        return True
+
+    def normalize(self, item, variant):
+        return {**item, "source": self.name, "query": variant}
+
+class TumblrTrends(TrendSource):
+    name, interval, keep, limit = "tumblr", 1200, 32, 4
+    TAGS     = ["haircare", "naturalhair", "curlyhair", "hairtransformation"]
+    IMAGE_RE = re.compile(r'"url":"(https://[^"]+tumblr[^"]+_500\.jpg)"')
+
+    def fetch(self, run):
+        tag = self.TAGS[run % len(self.TAGS)]
+        return tag, http_request("GET", f"https://www.tumblr.com/tagged/{tag}",
+                                 headers={"User-Agent": "Mozilla/5.0"}, timeout=8).text(errors="ignore")
+
+    def parse(self, raw, variant):
+        title = variant.replace("_", " ").title() + " inspiration"
+        for img in self.IMAGE_RE.findall(raw):
+            yield {"title": title, "image": img, "link": TREND_BLOG_LINK}
+
+    def keep_item(self, item):
+        return True
+
+TREND_SOURCES = {source.name: source for source in (RedditTrends(), PinterestTrends(), TumblrTrends())}
+
+def _trend_fixture_path(fixture_dir, name, variant):
+    return os.path.join(fixture_dir, f"{name}__{urllib.parse.quote(variant, safe='')}.raw")
+
+def record_trend_fixture(name, variant, raw):
+    """Keep the latest raw body per source and variant, for offline parsing."""
+    try:
+        os.makedirs(TREND_FIXTURE_DIR, exist_ok=True)
+        with open(_trend_fixture_path(TREND_FIXTURE_DIR, name, variant), "w", encoding="utf-8") as f:
+            f.write(raw)
+    except OSError as e:
+        print("Trend fixture write error:", e)
+
+def bench_trend_sources(fixture_dir=None, rounds=50):
+    """Replay every recorded fixture through its source's extract() and report
+    the parse cost — no network involved."""
+    fixture_dir = fixture_dir or TREND_FIXTURE_DIR
+    rounds      = max(1, rounds)
+    results = {}
+    for fname in sorted(os.listdir(fixture_dir)) if fixture_dir and os.path.isdir(fixture_dir) else []:
+        name, sep, rest = fname.partition("__")
+        if not sep or not rest.endswith(".raw") or name not in TREND_SOURCES:
+            continue
+        source  = TREND_SOURCES[name]
+        variant = urllib.parse.unquote(rest[:-len(".raw")])
+        with open(os.path.join(fixture_dir, fname), encoding="utf-8") as f:
+            raw = f.read()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            items = source.extract(raw, variant)
+        elapsed = time.perf_counter() - started
+        r = results.setdefault(name, {"fixtures": 0, "bytes": 0, "items": 0, "parse_us": 0.0})
+        r["fixtures"] += 1
+        r["bytes"]    += len(raw)
+        r["items"]    += len(items)
+        r["parse_us"] += elapsed / rounds * 1e6
+    for r in results.values():
+        r["parse_us"] = round(r["parse_us"] / r["fixtures"], 1)   # mean per fixture
+    return results
+
+class TrendStore:
+    """Scraped trend items per source, deduplicated by image URL and stamped
+    with when each was first and last seen.
+
+    Every source has its own state, so one that fails (blocked, timed out,
+    markup changed) keeps serving its last good items while the others carry
+    on; the failure is recorded and the next attempt backs off.
+    """
+
+    def __init__(self, sources):
+        self._lock    = threading.Lock()
+        self._sources = {}
+        for name, source in sources.items():
+            self._sources[name] = {
+                "source": source, "interval": source.interval, "keep": source.keep,
+                "items": OrderedDict(),          # image → item, least recently seen first
+                "wake": threading.Event(), "refreshing": False,
+                "runs": 0, "consecutive_errors": 0, "last_error": None,
+                "refreshed_at": None, "attempted_at": None,
+            }
+
+    def refresh(self, name):
+        """Scrape one source and merge what it returns. Returns the number of
+        seconds until it should run again."""
+        state = self._sources[name]
+        with self._lock:
+            if state["refreshing"]:
+                return state["interval"]
+            state["refreshing"] = True
+        started = time.time()
         try:
-            tags = ["haircare", "naturalhair", "curlyhair", "hairtransformation"]
-            tag = random.choice(tags)
-            url = f"https://www.tumblr.com/tagged/{tag}"
-            req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-            with urllib.request.urlopen(req, timeout=8) as r:
-                html = r.read().decode("utf-8", errors="ignore")
-            images = re.findall(r'"url":"(https://[^"]+tumblr[^"]+_500\.jpg)"', html)
-            for img in images[:4]:
-                with lock:
-                    results.append({"title": tag.replace("_"," ").title() + " inspiration", "image": img, "source": "tumblr", "link": "https://auto-engine.onrender.com/blog"})
+            items = state["source"].collect(state["runs"])
         except Exception as e:
-            print(f"Tumblr scrape error: {e}")
-
-    # Run all scrapers in parallel
-    threads = [
-        threading.Thread(target=scrape_reddit),
-        threading.Thread(target=scrape_pinterest),
-        threading.Thread(target=scrape_tumblr),
-    ]
-    for t in threads: t.start()
-    for t in threads: t.join(timeout=10)
+            print(f"{name.title()} scrape error: {e}")
+            with self._lock:
+                state.update(refreshing=False, attempted_at=started, last_error=str(e))
+                state["runs"] += 1
+                state["consecutive_errors"] += 1
+                backoff = TREND_RETRY_SECONDS * 2 ** (state["consecutive_errors"] - 1)
+            return min(state["interval"], backoff)
+        now = time.time()
+        with self._lock:
+            stored = state["items"]
+            for item in items:
+                seen = stored.pop(item["image"], None)
+                stored[item["image"]] = {**item, "first_seen": seen["first_seen"] if seen else now,
+                                         "last_seen": now}
+            while len(stored) > state["keep"]:
+                stored.popitem(last=False)
+            state.update(refreshing=False, attempted_at=started, refreshed_at=now, consecutive_errors=0)
+            state["runs"] += 1
+        return state["interval"]
+
+    def items(self, name):
+        """Newest first. Never blocks on the network: a source past its
+        interval is served as-is and its refresher is woken to revalidate."""
+        state = self._sources[name]
+        with self._lock:
+            items = list(reversed(state["items"].values()))
+            stale = (not state["refreshing"] and state["consecutive_errors"] == 0 and
+                     (state["refreshed_at"] is None or
+                      time.time() - state["refreshed_at"] > state["interval"]))
+        if stale:
+            state["wake"].set()
+        return items
+
+    def run(self, name):
+        """Refresh loop for one source — one daemon thread each."""
+        state = self._sources[name]
+        while True:
+            delay = self.refresh(name)
+            state["wake"].wait(delay)
+            state["wake"].clear()
+
+    def start(self):
+        for name in self._sources:
+            threading.Thread(target=self.run, args=(name,), daemon=True).start()
+
+    def report(self):
+        now = time.time()
+        with self._lock:
+            return {name: {
+                **s["source"].report(),
+                "stored":             len(s["items"]),
+                "consecutive_errors": s["consecutive_errors"],
+                "last_error":         s["last_error"],
+                "age_seconds":        round(now - s["refreshed_at"]) if s["refreshed_at"] else None,
+                "interval_seconds":   s["interval"],
+            } for name, s in self._sources.items()}
+
+TREND_STORE = TrendStore(TREND_SOURCES)
+background(TREND_STORE.start)
+
+def _public_trend(item, *keys):
+    return {k: item[k] for k in keys}
+
+def _trend_response(payload):
+    resp = jsonify(payload)
+    resp.cache_control.public  = True
+    resp.cache_control.max_age = TREND_MAX_AGE
+    return resp
 
+@app.route("/api/hair-trends")
+def hair_trends():
+    """Trending hair content from multiple platforms, served from TREND_STORE."""
+    def pick(name, k, window):
+        recent = TREND_STORE.items(name)[:window]
+        return random.sample(recent, min(k, len(recent)))
+    results = pick("reddit", 8, 8) + pick("pinterest", 6, 24) + pick("tumblr", 4, 12)
     random.shuffle(results)
-    return jsonify({"ok": True, "items": results[:15]})
+    return _trend_response({"ok": True, "items": [_public_trend(r, "title", "image", "source", "link")
+                                                  for r in results[:15]]})
 
 @app.route("/api/pinterest-trends")
 def pinterest_trends():
-    """Scrape and return trending Pinterest hair content."""
-    import re, urllib.request, urllib.parse, random
-    queries = ["hair care routine", "hair growth tips", "damaged hair repair", "curly hair", "hair loss treatment"]
-    query = random.choice(queries)
-    pins = []
-    try:
-        url = f"https://pinterest.com/search/pins/?q={urllib.parse.quote(query)}&rs=typed"
-        req = urllib.request.Request(url, headers={
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9"
-        })
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            html = resp.read().decode("utf-8", errors="ignore")
-        # Extract image URLs and titles
-        images = re.findall(r'"url"\s*:\s*"(https://i\.pinimg\.com/[^"]+736[^"]+\.jpg)"', html)
-        titles = re.findall(r'"title"\s*:\s*"([^"]{15,100})"', html)
-        hair_titles = [t for t in titles if any(kw in t.lower() for kw in
-            ["hair", "curl", "scalp", "growth", "damage", "frizz", "moisture", "routine"])]
-        for i, img in enumerate(images[:12]):
-            pins.append({
-                "image": img,
-                "title": hair_titles[i] if i < len(hair_titles) else query,
-                "link": f"https://auto-engine.onrender.com/blog"
-            })
-    except Exception as e:
-        print(f"Pinterest scrape error: {e}")
-    return jsonify({"ok": True, "pins": pins, "query": query})
+    """Trending Pinterest hair content for one search query, served from TREND_STORE."""
+    stored  = TREND_STORE.items("pinterest")
+    queries = sorted({p["query"] for p in stored})
+    query   = random.choice(queries or PinterestTrends.QUERIES)
+    pins    = [_public_trend(p, "image", "title", "link") for p in stored if p["query"] == query][:12]
+    return _trend_response({"ok": True, "pins": pins, "query": query})
+
+@app.route("/api/trends/stats", methods=["GET"])
+def trend_stats():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    return jsonify(TREND_STORE.report())
 
+@app.route("/api/admin/trend-bench", methods=["GET"])
+def trend_bench():
+    """Parse cost of each source over its recorded fixtures (TREND_FIXTURE_DIR)."""
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    rounds = request.args.get("rounds", 50, type=int)
+    return jsonify(bench_trend_sources(rounds=max(1, min(rounds, 1000))))
 
 # ── SHARED: PAGE LOADER + NAV (exact Shopify Savor theme) ────────────────────
 
@@ -2615,29 +4604,106 @@ SRD_NAV_HTML = """
 })();
 </script>"""
 
-def blog_get_index():
-    try:
-        db = sqlite3.connect(BLOG_DB, timeout=10, check_same_thread=False)
-        db.row_factory = sqlite3.Row
-        rows = db.execute("SELECT handle, title, meta, date FROM posts ORDER BY date DESC LIMIT 90").fetchall()
-        db.close()
-        return [dict(r) for r in rows]
-    except Exception as e:
-        print(f"blog_get_index error: {e}")
-        return []
+# Blog pages share the loader and nav chrome as bundles, so a reader downloads
+# them once. SRD_NAV_CSS was written with f-string brace escapes but is only
+# ever interpolated as a value — unescape it for the stylesheet.
+SRD_PAGE_LOADER = externalize_assets(SRD_PAGE_LOADER, "srd-loader")
+SRD_NAV_HTML    = externalize_assets(SRD_NAV_HTML, "srd-nav")
+SRD_NAV_CSS_URL = register_asset("srd-nav", "css", SRD_NAV_CSS.replace("{{", "{").replace("}}", "}"))
 
-def blog_get_post(handle):
+# ── BLOG RENDER CACHE (rendered /blog pages, precompressed, per handle) ───────
+BLOG_CACHE_TTL     = int(os.environ.get("BLOG_CACHE_TTL", "300"))
+BLOG_CACHE_ENTRIES = int(os.environ.get("BLOG_CACHE_ENTRIES", "500"))
+BLOG_MAX_AGE       = int(os.environ.get("BLOG_MAX_AGE", "300"))
+
+def post_modified(date):
+    """Parse a post `date` string (ISO date or datetime, UTC assumed), or None."""
     try:
-        con = sqlite3.connect(BLOG_DB, timeout=10, check_same_thread=False)
-        con.row_factory = sqlite3.Row
-        row = con.execute("SELECT * FROM posts WHERE handle=?", (handle,)).fetchone()
-        con.close()
-        return dict(row) if row else None
-    except Exception as e:
-        print(f"blog_get_post error: {e}")
+        dt = datetime.datetime.fromisoformat((date or "").replace("Z", "+00:00"))
+    except ValueError:
         return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+
+class BlogPageCache:
+    """TTL + LRU cache of rendered blog pages keyed by handle ("" is the first
+    index page), each stored as its encoded variants with an ETag over the
+    bytes. Later index pages are keyed by client-supplied cursors, so they are
+    rendered per request rather than cached where they could evict real pages.
+
+    No Last-Modified is sent: posts are edited in place without touching their
+    date, so only the ETag reliably changes when a page does.
+
+    blog_save_post() invalidates the post and the index in this worker; the
+    TTL bounds how long other workers keep serving the old page. A render
+    that started before an invalidation is not stored.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl, self.max_entries = ttl, max_entries
+        self._pages      = OrderedDict()   # key -> page dict
+        self._lock       = threading.Lock()
+        self._generation = 0
+        self.stats       = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key, build):
+        """Cached page for `key`, or build() → (html, cacheable) and cache it
+        unless cacheable is false (e.g. a fallback rendered after a DB error).
+        Returns None when build() does."""
+        now = time.time()
+        with self._lock:
+            page = self._pages.get(key)
+            if page and page["expires"] > now:
+                self._pages.move_to_end(key)
+                self.stats["hits"] += 1
+                return page
+            self.stats["misses"] += 1
+            generation = self._generation
+        built = build()
+        if built is None:
+            return None
+        html, cacheable = built
+        page = {**self.encode(html), "expires": now + self.ttl}
+        with self._lock:
+            if cacheable and generation == self._generation:
+                self._pages[key] = page
+                self._pages.move_to_end(key)
+                while len(self._pages) > self.max_entries:
+                    self._pages.popitem(last=False)
+        return page
+
+    def invalidate(self, handle=None):
+        with self._lock:
+            self._generation += 1
+            self.stats["invalidations"] += 1
+            if handle is None:
+                self._pages.clear()
+                return
+            self._pages.pop(handle, None)
+            self._pages.pop("", None)
+
+    @staticmethod
+    def encode(html):
+        body = html.encode("utf-8")
+        return {"variants": compress_variants(body), "etag": hashlib.sha1(body).hexdigest()}
+
+    @staticmethod
+    def serve(page):
+        return negotiated_response(page["variants"], page["etag"], max_age=BLOG_MAX_AGE)
+
+    def report(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._pages)}
+
+BLOG_PAGES = BlogPageCache(BLOG_CACHE_TTL, BLOG_CACHE_ENTRIES)
+
+@app.route("/api/blog/cache-stats", methods=["GET"])
+def blog_cache_stats():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    return jsonify(BLOG_PAGES.report())
 
 @app.route("/blog-embed")
+@prerendered
 def blog_embed():
     return """<!DOCTYPE html>
 <html lang="en">
@@ -2691,7 +4757,26 @@ window.addEventListener('resize', function() {
 
 @app.route("/blog")
 def blog_index():
-    posts = blog_get_index()
+    cursor = request.args.get("cursor", "")
+    if not cursor:
+        return BLOG_PAGES.serve(BLOG_PAGES.get("", render_blog_index))
+    try:
+        html, _ = render_blog_index(cursor)
+        return BLOG_PAGES.serve(BLOG_PAGES.encode(html))
+    except ValueError:
+        return "<h2>Page not found</h2>", 404
+
+def render_blog_index(cursor=None):
+    """(html, cacheable) for one index page; an empty listing, not cached,
+    if the DB read fails. Raises ValueError for a malformed cursor."""
+    cacheable = True
+    try:
+        posts, next_cursor = blog_get_page(BLOG_PAGE_SIZE, cursor)
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"blog_get_index error: {e}")
+        posts, next_cursor, cacheable = [], None, False
     cards = ""
     for p in posts:
         date = p.get("date","")[:10]
@@ -2707,6 +4792,12 @@ def blog_index():
     if not cards:
         cards = '<p class="empty">No posts yet — check back soon.</p>'
 
+    pager = ""
+    if cursor:
+        pager += '<a href="/blog">← Latest articles</a>'
+    if next_cursor:
+        pager += f'<a href="/blog?cursor={next_cursor}">Older articles →</a>'
+
     return f"""<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -2716,8 +4807,8 @@ def blog_index():
 <meta name="description" content="Expert hair care tips, routines and advice from SupportRD.">
 <link href="https://fonts.googleapis.com/css2?family=Cormorant+Garamond:ital,wght@0,400;0,600;1,300;1,400&family=Jost:wght@300;400;500&display=swap" rel="stylesheet">
 {SRD_PAGE_LOADER}
+<link rel="stylesheet" href="{SRD_NAV_CSS_URL}">
 <style>
-{SRD_NAV_CSS}
 .header-brand{{text-align:center;padding:48px 24px 36px;background:#f0ebe8;}}
 .header-brand h1{{font-family:'Cormorant Garamond',serif;font-size:clamp(32px,5vw,48px);font-style:italic;font-weight:400;color:#0d0906;}}
 .header-brand p{{font-size:13px;color:rgba(0,0,0,0.4);margin-top:10px;letter-spacing:0.10em;text-transform:uppercase;}}
@@ -2731,6 +4822,8 @@ def blog_index():
 .post-card .meta{{font-size:13px;color:rgba(0,0,0,0.45);line-height:1.6;margin-bottom:12px;}}
 .post-card .date{{font-size:11px;color:#c1a3a2;letter-spacing:0.08em;}}
 .empty{{text-align:center;color:rgba(0,0,0,0.3);padding:60px;font-size:14px;}}
+.pager{{display:flex;justify-content:space-between;gap:16px;margin-top:12px;}}
+.pager a{{font-size:11px;color:#c1a3a2;letter-spacing:0.14em;text-transform:uppercase;text-decoration:none;}}
 footer{{text-align:center;padding:40px;font-size:12px;color:rgba(0,0,0,0.3);border-top:1px solid rgba(193,163,162,0.12);}}
 footer a{{color:#c1a3a2;text-decoration:none;}}
 </style>
@@ -2745,16 +4838,23 @@ footer a{{color:#c1a3a2;text-decoration:none;}}
   <div class="section-label">&#10022; Expert guides</div>
   <div class="section-title">Latest Articles</div>
   {cards}
+  <nav class="pager">{pager}</nav>
 </div>
 <footer><a href="https://supportrd.com">← Back to SupportRD</a> &nbsp;·&nbsp; <a href="https://ai-hair-advisor.onrender.com">Try Aria AI →</a></footer>
-</body></html>"""
+</body></html>""", cacheable
 
 
 @app.route("/blog/<handle>")
 def blog_post(handle):
+    page = BLOG_PAGES.get(handle, lambda: render_blog_post(handle))
+    if not page:
+        return "<h2>Post not found</h2>", 404
+    return BLOG_PAGES.serve(page)
+
+def render_blog_post(handle):
     post = blog_get_post(handle)
     if not post:
-        return "<h2>Post not found</h2>", 404
+        return None
 
     date = post.get("date","")[:10]
     return f"""<!DOCTYPE html>
@@ -2767,8 +4867,8 @@ def blog_post(handle):
 <link rel="canonical" href="https://ai-hair-advisor.onrender.com/blog/{handle}">
 <link href="https://fonts.googleapis.com/css2?family=Cormorant+Garamond:ital,wght@0,400;0,600;1,300;1,400&family=Jost:wght@300;400;500&display=swap" rel="stylesheet">
 {SRD_PAGE_LOADER}
+<link rel="stylesheet" href="{SRD_NAV_CSS_URL}">
 <style>
-{SRD_NAV_CSS}
 .container{{max-width:720px;margin:0 auto;padding:48px 24px;}}
 .post-date{{font-size:11px;color:#c1a3a2;letter-spacing:0.10em;margin-bottom:16px;text-transform:uppercase;}}
 .post-body{{background:#fff;border-radius:20px;padding:48px;box-shadow:0 2px 20px rgba(0,0,0,0.06);line-height:1.8;font-size:15px;border:1px solid rgba(193,163,162,0.12);}}
@@ -2797,45 +4897,99 @@ footer a{{color:#c1a3a2;text-decoration:none;}}
   </div>
 </div>
 <footer><a href="https://supportrd.com">SupportRD</a> &nbsp;·&nbsp; <a href="/blog">← More Articles</a></footer>
-</body></html>"""
+</body></html>""", True
 
 
-@app.route("/sitemap.xml")
-def sitemap():
-    import glob
-    BLOG_DIR = "/tmp/srd_blog"
-    base_url = "https://auto-engine.onrender.com"
-    
-    urls = []
-    
-    # Blog index
-    urls.append(f"""  <url>
-    <loc>{base_url}/blog</loc>
-    <changefreq>daily</changefreq>
-    <priority>0.8</priority>
-  </url>""")
-    
-    # Individual posts
-    try:
-        with open(f"{BLOG_DIR}/index.json","r") as f:
-            posts = json.load(f)
-        for p in posts:
-            date = p.get("date","")[:10]
-            urls.append(f"""  <url>
-    <loc>{base_url}/blog/{p["handle"]}</loc>
-    <lastmod>{date}</lastmod>
-    <changefreq>monthly</changefreq>
-    <priority>0.7</priority>
-  </url>""")
-    except:
-        pass
+# ── SITEMAP (built from the posts table, cached until a post changes) ─────────
+SITEMAP_BASE_URL = os.environ.get("SITEMAP_BASE_URL", "https://auto-engine.onrender.com")
+SITEMAP_MAX_URLS = 50000    # per file, the protocol limit
+SITEMAP_TTL      = int(os.environ.get("SITEMAP_TTL", "3600"))
+SITEMAP_MAX_AGE  = int(os.environ.get("SITEMAP_MAX_AGE", "3600"))
+
+class SitemapCache:
+    """The sitemap documents as encoded bytes, built in one pass over the
+    covering posts index and kept until blog_save_post() invalidates them
+    (or SITEMAP_TTL passes, for saves made by another worker).
 
-    xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+    Up to SITEMAP_MAX_URLS URLs, /sitemap.xml is the urlset itself; past that
+    it becomes a sitemap index over /sitemap-1.xml, /sitemap-2.xml, ... Posts
+    go oldest first, so new posts land in the last file.
+    """
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._docs    = None     # name → {"variants", "etag", "last_modified"}
+        self._expires = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._docs = None
+
+    def get(self, name):
+        with self._lock:
+            if self._docs is None or time.time() > self._expires:
+                self._docs    = self._build()
+                self._expires = time.time() + SITEMAP_TTL
+            return self._docs.get(name)
+
+    @staticmethod
+    def _url(loc, lastmod, changefreq, priority):
+        from xml.sax.saxutils import escape
+        lastmod = f"\n    <lastmod>{lastmod[:10]}</lastmod>" if post_modified(lastmod) else ""
+        return f"""  <url>
+    <loc>{escape(loc)}</loc>{lastmod}
+    <changefreq>{changefreq}</changefreq>
+    <priority>{priority}</priority>
+  </url>"""
+
+    @staticmethod
+    def _doc(xml, newest):
+        body = xml.encode("utf-8")
+        return {"variants": compress_variants(body, brotli_quality=6),
+                "etag": hashlib.sha1(body).hexdigest(), "last_modified": post_modified(newest)}
+
+    def _build(self):
+        chunks, newest = [[]], ""     # per file: [(url entry, date)]
+        def add(entry, date):
+            if len(chunks[-1]) == SITEMAP_MAX_URLS:
+                chunks.append([])
+            chunks[-1].append((entry, date))
+        for rows in BLOG_POOL.iterate("SELECT handle, date FROM posts ORDER BY date, handle"):
+            for handle, date in rows:
+                date   = date or ""
+                newest = max(newest, date)
+                add(self._url(f"{SITEMAP_BASE_URL}/blog/{urllib.parse.quote(handle)}", date, "monthly", "0.7"), date)
+        add(self._url(f"{SITEMAP_BASE_URL}/blog", newest, "daily", "0.8"), newest)
+
+        def urlset(chunk):
+            return f"""<?xml version="1.0" encoding="UTF-8"?>
 <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-{chr(10).join(urls)}
+{chr(10).join(entry for entry, _ in chunk)}
 </urlset>"""
-    
-    return Response(xml, mimetype="application/xml")
+        if len(chunks) == 1:
+            return {"sitemap.xml": self._doc(urlset(chunks[0]), newest)}
+        docs, entries = {}, []
+        for i, chunk in enumerate(chunks, 1):
+            chunk_newest = max(date for _, date in chunk)
+            docs[f"sitemap-{i}.xml"] = self._doc(urlset(chunk), chunk_newest)
+            lastmod = f"<lastmod>{chunk_newest[:10]}</lastmod>" if post_modified(chunk_newest) else ""
+            entries.append(f"  <sitemap><loc>{SITEMAP_BASE_URL}/sitemap-{i}.xml</loc>{lastmod}</sitemap>")
+        docs["sitemap.xml"] = self._doc(f"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+{chr(10).join(entries)}
+</sitemapindex>""", newest)
+        return docs
+
+SITEMAP = SitemapCache()
+
+@app.route("/sitemap.xml")
+@app.route("/sitemap-<int:part>.xml")
+def sitemap(part=None):
+    doc = SITEMAP.get("sitemap.xml" if part is None else f"sitemap-{part}.xml")
+    if not doc:
+        return Response("Not found", status=404, mimetype="text/plain")
+    return negotiated_response(doc["variants"], doc["etag"], mimetype="application/xml",
+                               max_age=SITEMAP_MAX_AGE, last_modified=doc["last_modified"])
 
 
 @app.route("/robots.txt")
@@ -2867,40 +5021,36 @@ def transcribe():
         if not audio_file:
             return jsonify({"error": "No audio"}), 400
 
-        import urllib.request as urlreq
-
-        boundary = "SRDBoundary" + secrets.token_hex(8)
-        audio_data = audio_file.read()
-
-        CRLF = b"\r\n"
-        body = b""
-        body += b"--" + boundary.encode() + CRLF
-        body += b'Content-Disposition: form-data; name="model"' + CRLF + CRLF
-        body += b"whisper-1" + CRLF
-        body += b"--" + boundary.encode() + CRLF
-        body += b'Content-Disposition: form-data; name="language"' + CRLF + CRLF
-        body += b"en" + CRLF
-        body += b"--" + boundary.encode() + CRLF
-        body += b'Content-Disposition: form-data; name="file"; filename="audio.webm"' + CRLF
-        body += b"Content-Type: audio/webm" + CRLF + CRLF
-        body += audio_data + CRLF
-        body += b"--" + boundary.encode() + b"--" + CRLF
-
-        req = urlreq.Request(
-            "https://api.openai.com/v1/audio/transcriptions",
+        body, content_type = whisper_multipart(audio_file.read())
+        result = http_request("POST", "https://api.openai.com/v1/audio/transcriptions",
             data=body,
             headers={
                 "Authorization": "Bearer " + OPENAI_API_KEY,
-                "Content-Type": "multipart/form-data; boundary=" + boundary
+                "Content-Type": content_type
             },
-            method="POST"
-        )
-        with urlreq.urlopen(req, timeout=30) as resp:
-            result = json.loads(resp.read().decode())
-            return jsonify({"text": result.get("text", "")})
+            timeout=30).json()
+        return jsonify({"text": result.get("text", "")})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def whisper_multipart(audio_data):
+    """Build the multipart/form-data body for a Whisper transcription request."""
+    boundary = "SRDBoundary" + secrets.token_hex(8)
+    CRLF = b"\r\n"
+    body = b""
+    body += b"--" + boundary.encode() + CRLF
+    body += b'Content-Disposition: form-data; name="model"' + CRLF + CRLF
+    body += b"whisper-1" + CRLF
+    body += b"--" + boundary.encode() + CRLF
+    body += b'Content-Disposition: form-data; name="language"' + CRLF + CRLF
+    body += b"en" + CRLF
+    body += b"--" + boundary.encode() + CRLF
+    body += b'Content-Disposition: form-data; name="file"; filename="audio.webm"' + CRLF
+    body += b"Content-Type: audio/webm" + CRLF + CRLF
+    body += audio_data + CRLF
+    body += b"--" + boundary.encode() + b"--" + CRLF
+    return body, "multipart/form-data; boundary=" + boundary
+
 
 @app.route("/api/ping", methods=["GET"])
 def ping():
@@ -2962,6 +5112,10 @@ def admin_codes_page():
     admin_key = request.args.get("key","")
     if admin_key != os.environ.get("ADMIN_KEY","srd_admin_2024"):
         return "<h2>Unauthorized</h2>", 401
+    return admin_codes_html()
+
+@prerendered(private=True)
+def admin_codes_html():
     return """<!DOCTYPE html>
 <html><head><meta charset="UTF-8">
 <title>SupportRD — Premium Codes</title>
@@ -3152,31 +5306,28 @@ loadEngineLog();
 
 @app.route("/api/debug-shopify2", methods=["GET"])
 def debug_shopify2():
-    import requests
     store = os.environ.get("SHOPIFY_STORE","")
     token = os.environ.get("SHOPIFY_ADMIN_TOKEN","")
     url = f"https://{store}/admin/api/2024-01/blogs.json"
     headers = {"X-Shopify-Access-Token": token}
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = http_request("GET", url, headers=headers, timeout=10, retries=0, raise_for_status=False)
         return jsonify({
             "store": store,
             "token_prefix": token[:12] if token else "NOT SET",
             "token_length": len(token),
-            "status": resp.status_code,
-            "response": resp.text[:300]
+            "status": resp.status,
+            "response": resp.text(errors="replace")[:300]
         })
     except Exception as e:
         return jsonify({"error": str(e)})
 
 @app.route("/api/debug-shopify", methods=["GET"])
 def debug_shopify():
-    import urllib.request as urlreq
     try:
         url = f"https://{SHOPIFY_STORE}/admin/api/2023-10/shop.json"
-        req = urlreq.Request(url, headers={"X-Shopify-Access-Token": SHOPIFY_ADMIN_TOKEN})
-        resp = urlreq.urlopen(req, timeout=10)
-        data = json.loads(resp.read())
+        data = http_request("GET", url, headers={"X-Shopify-Access-Token": SHOPIFY_ADMIN_TOKEN},
+                            timeout=10).json()
         return jsonify({"ok": True, "shop": data.get("shop",{}).get("name"), "token_set": bool(SHOPIFY_ADMIN_TOKEN)})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e), "store": SHOPIFY_STORE, "token_set": bool(SHOPIFY_ADMIN_TOKEN)})
@@ -3221,15 +5372,14 @@ def test_register():
 
 def _keep_alive():
     import time
-    import urllib.request as _urlreq
     _url = os.environ.get("APP_BASE_URL","https://ai-hair-advisor.onrender.com") + "/api/ping"
     time.sleep(60)  # Wait for server to fully start
     while True:
         time.sleep(600)  # Ping every 10 minutes
-        try: _urlreq.urlopen(_url, timeout=10)
+        try: http_request("GET", _url, timeout=10, retries=0).close()
         except: pass
 
-threading.Thread(target=_keep_alive, daemon=True).start()
+background_thread(_keep_alive)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
@@ -3278,63 +5428,293 @@ def _make_movement_event(source="simulated", mins_ago=None):
         "source":  source
     }
 
-# Seed 15 simulated events on startup (so the feed is never empty)
-_MOVEMENT_EVENTS = [_make_movement_event(mins_ago=random.randint(1,55)) for _ in range(15)]
+# Which cities a real event is attributed to, by the visitor's language
+_LANG_CITIES = {
+    "en-US": [("New York, NY","🇺🇸"),("Miami, FL","🇺🇸"),("Atlanta, GA","🇺🇸"),
+              ("Chicago, IL","🇺🇸"),("Los Angeles, CA","🇺🇸")],
+    "es-ES": [("Madrid","🇪🇸"),("Barcelona","🇪🇸")],
+    "pt-BR": [("Bogotá","🇨🇴"),("Medellín","🇨🇴")],
+    "fr-FR": [("Paris","🇫🇷"),("Montreal","🇨🇦")],
+    "de-DE": [("London","🇬🇧"),("Toronto","🇨🇦")],
+    "ar-SA": [("Santo Domingo","🇩🇴"),("Santiago, DR","🇩🇴")],
+    "zh-CN": [("New York, NY","🇺🇸"),("Los Angeles, CA","🇺🇸")],
+    "hi-IN": [("Houston, TX","🇺🇸"),("Chicago, IL","🇺🇸")],
+}
+_LIVE_ACTIONS = ["just ordered {product}", "reordered {product} for their salon",
+                 "recommended {product} to a client"]
+
+MOVEMENT_REFRESH_SECONDS   = float(os.environ.get("MOVEMENT_REFRESH_SECONDS", "15"))
+MOVEMENT_POLL_SECONDS      = float(os.environ.get("MOVEMENT_POLL_SECONDS", "1"))
+MOVEMENT_STORE_CAPACITY    = int(os.environ.get("MOVEMENT_STORE_CAPACITY", "80"))
+MOVEMENT_MAX_AGE           = int(os.environ.get("MOVEMENT_MAX_AGE", "10"))
+MOVEMENT_HEARTBEAT_SECONDS = float(os.environ.get("MOVEMENT_HEARTBEAT_SECONDS", "20"))
+MOVEMENT_SUBSCRIBER_BUFFER = int(os.environ.get("MOVEMENT_SUBSCRIBER_BUFFER", "50"))
+MOVEMENT_STREAM_MAX_SECONDS = float(os.environ.get("MOVEMENT_STREAM_MAX_SECONDS", "300"))
+
+class MovementHub:
+    """Fan-out of new movement events to every connected stream.
+
+    A subscriber is a `deliver(event)` callable; it must not block. Each one
+    owns a bounded buffer that drops its oldest event when a slow client
+    falls behind, so one stalled connection never holds up the rest.
+    """
 
-@app.route("/api/movement", methods=["GET","OPTIONS"])
-def movement():
-    """Return recent movement events — mix of real orders + simulated activity."""
-    live = []
-    # Pull real orders from analytics DB (last 30)
-    try:
-        con = get_analytics_db()
-        rows = con.execute(
-            "SELECT ts, lang, product FROM events ORDER BY id DESC LIMIT 30"
-        ).fetchall()
-        con.close()
-        lang_city = {
-            "en-US": [("New York, NY","🇺🇸"),("Miami, FL","🇺🇸"),("Atlanta, GA","🇺🇸"),
-                      ("Chicago, IL","🇺🇸"),("Los Angeles, CA","🇺🇸")],
-            "es-ES": [("Madrid","🇪🇸"),("Barcelona","🇪🇸")],
-            "pt-BR": [("Bogotá","🇨🇴"),("Medellín","🇨🇴")],
-            "fr-FR": [("Paris","🇫🇷"),("Montreal","🇨🇦")],
-            "de-DE": [("London","🇬🇧"),("Toronto","🇨🇦")],
-            "ar-SA": [("Santo Domingo","🇩🇴"),("Santiago, DR","🇩🇴")],
-            "zh-CN": [("New York, NY","🇺🇸"),("Los Angeles, CA","🇺🇸")],
-            "hi-IN": [("Houston, TX","🇺🇸"),("Chicago, IL","🇺🇸")],
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.stats = {"published": 0, "dropped": 0}
+
+    def subscribe(self, deliver):
+        with self._lock:
+            self._subscribers.add(deliver)
+        return deliver
+
+    def unsubscribe(self, deliver):
+        with self._lock:
+            self._subscribers.discard(deliver)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats["published"] += 1
+        for deliver in subscribers:
+            try:
+                deliver(event)
+            except Exception as e:
+                print("Movement subscriber error:", e)
+
+    def offer(self, buffer, event):
+        """Put into a bounded queue, evicting the oldest entry when it is full."""
+        while True:
+            try:
+                buffer.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    buffer.get_nowait()
+                    self.count_drop()
+                except queue.Empty:
+                    pass
+
+    def count_drop(self):
+        with self._lock:
+            self.stats["dropped"] += 1
+
+    def report(self):
+        with self._lock:
+            return {**self.stats, "subscribers": len(self._subscribers)}
+
+MOVEMENT_HUB = MovementHub()
+_movement_wake = threading.Event()
+
+class MovementStore:
+    """Fixed-capacity ring of movement events in analytics.db, shared by every
+    worker process, with a lock-protected in-memory mirror for reads.
+
+    append() bumps the shared sequence and overwrites slot seq % capacity —
+    O(1), no trimming. sync() pulls rows newer than the last sequence this
+    process has seen (an indexed range read) into the mirror.
+    """
+
+    def __init__(self, pool, capacity=MOVEMENT_STORE_CAPACITY):
+        self.pool     = pool
+        self.capacity = capacity
+        self.last_seq = 0
+        self._lock    = threading.Lock()
+        self._events  = deque(maxlen=capacity)   # oldest → newest
+
+    def append(self, event):
+        with self.pool.transaction() as con:
+            seq = con.execute("UPDATE movement_state SET seq = seq + 1 WHERE id=1 RETURNING seq").fetchone()[0]
+            con.execute("INSERT OR REPLACE INTO movement_ring (slot, seq, event) VALUES (?,?,?)",
+                        (seq % self.capacity, seq, json.dumps(event)))
+        return seq
+
+    def sync(self):
+        """Mirror events appended (by any worker) since the last sync; returns them oldest first."""
+        rows = self.pool.read("SELECT seq, event FROM movement_ring WHERE seq > ? ORDER BY seq",
+                              (self.last_seq,))
+        if not rows:
+            return []
+        fresh = [json.loads(event) for _seq, event in rows]
+        with self._lock:
+            self._events.extend(fresh)
+            self.last_seq = rows[-1][0]
+        return fresh
+
+    def recent(self):
+        """Newest first."""
+        with self._lock:
+            return list(reversed(self._events))
+
+MOVEMENT_STORE     = MovementStore(ANALYTICS_POOL)
+_movement_lock     = threading.Lock()
+_MOVEMENT_SNAPSHOT = None # {"body", "etag", "last_modified"} — replaced, never mutated
+
+def _live_movement_event(ts, lang, product):
+    city, flag = random.choice(_LANG_CITIES.get(lang, [("Miami, FL","🇺🇸")]))
+    return {
+        "id":      hash(ts+product) % 999999,
+        "city":    city, "flag": flag,
+        "action":  random.choice(_LIVE_ACTIONS).format(product=product), "product": product,
+        "ts":      ts, "source": "real"
+    }
+
+def _movement_leader():
+    """Take or renew the lease that makes this worker the one producing
+    simulated and real-order events. Returns True while we hold it.
+
+    The lease is read first without a transaction: a follower facing a live
+    lease, or a leader with more than half of its lease left, never takes
+    the analytics write lock."""
+    now    = time.time()
+    worker = f"{os.uname().nodename}:{os.getpid()}"
+    lease  = 3 * max(MOVEMENT_POLL_SECONDS, 1)
+    leader, lease_until = ANALYTICS_POOL.read(
+        "SELECT leader, lease_until FROM movement_state WHERE id=1", fetchone=True)
+    if leader != worker and lease_until >= now:
+        return False
+    if leader == worker and lease_until - now > lease / 2:
+        return True
+    with ANALYTICS_POOL.transaction() as con:
+        return con.execute("""UPDATE movement_state SET leader=?, lease_until=?
+            WHERE id=1 AND (leader=? OR lease_until < ?)""",
+            (worker, now + lease, worker, now)).rowcount == 1
+
+def _produce_movement_events(simulate):
+    """Leader only: turn newly logged orders into feed events, add a simulated
+    one if due, and seed the feed the very first time."""
+    seq, after, newest = ANALYTICS_POOL.read("""SELECT seq, events_after,
+        (SELECT COALESCE(MAX(id), 0) FROM events) FROM movement_state WHERE id=1""", fetchone=True)
+    if seq and not simulate and newest <= after:
+        return      # nothing to do: stay off the write lock
+    with ANALYTICS_POOL.transaction() as con:
+        seq, after = con.execute("SELECT seq, events_after FROM movement_state WHERE id=1").fetchone()
+        rows = con.execute("""SELECT id, ts, lang, product FROM events
+            WHERE id > ? ORDER BY id DESC LIMIT 30""", (after,)).fetchall()
+        for (_id, ts, lang, product) in reversed(rows):
+            if product and product != "Unknown":
+                MOVEMENT_STORE.append(_live_movement_event(ts, lang, product))
+        if rows:
+            con.execute("UPDATE movement_state SET events_after=? WHERE id=1", (rows[0][0],))
+        if seq == 0:
+            # Seed 15 simulated events (so the feed is never empty)
+            for mins in sorted((random.randint(1, 55) for _ in range(15)), reverse=True):
+                MOVEMENT_STORE.append(_make_movement_event(mins_ago=mins))
+        elif simulate:
+            MOVEMENT_STORE.append(_make_movement_event(mins_ago=0))
+
+def refresh_movement():
+    """Sync the shared store, rebuild the /api/movement snapshot if anything
+    changed and push the new events to this worker's stream subscribers."""
+    global _MOVEMENT_SNAPSHOT
+    with _movement_lock:
+        fresh = MOVEMENT_STORE.sync()
+        if not fresh and _MOVEMENT_SNAPSHOT is not None:
+            return _MOVEMENT_SNAPSHOT
+        events = MOVEMENT_STORE.recent()
+        # Merge: real first, then simulated/transcript to fill up to 15
+        combined = ([e for e in events if e.get("source") == "real"][:30] +
+                    [e for e in events if e.get("source") != "real"])[:15]
+        body = json.dumps({
+            "events": combined,
+            "total":  len(combined) + random.randint(80, 140)  # social proof count
+        }).encode("utf-8")
+        _MOVEMENT_SNAPSHOT = {
+            "body":          body,
+            "etag":          hashlib.sha1(body).hexdigest(),
+            "last_modified": datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0),
         }
-        for (ts, lang, product) in rows:
-            if not product or product == "Unknown":
-                continue
-            city_list = lang_city.get(lang, [("Miami, FL","🇺🇸")])
-            city, flag = random.choice(city_list)
-            action = random.choice([
-                f"just ordered {product}",
-                f"reordered {product} for their salon",
-                f"recommended {product} to a client",
-            ])
-            live.append({
-                "id":      hash(ts+product) % 999999,
-                "city":    city, "flag": flag,
-                "action":  action, "product": product,
-                "ts":      ts, "source": "real"
-            })
-    except Exception as e:
-        print("Movement DB error:", e)
+        snapshot = _MOVEMENT_SNAPSHOT
+    for event in fresh:     # oldest first, so clients can prepend in order
+        MOVEMENT_HUB.publish(event)
+    return snapshot
+
+def add_movement_event(event):
+    """Append to the shared feed and publish it from this worker right away;
+    the others pick it up on their next poll."""
+    MOVEMENT_STORE.append(event)
+    refresh_movement()
+
+def _movement_refresher():
+    # Every worker polls the shared store; the lease holder also produces
+    # events — real orders as soon as the analytics writer commits them,
+    # a simulated one every MOVEMENT_REFRESH_SECONDS
+    next_simulated = time.time() + MOVEMENT_REFRESH_SECONDS
+    while True:
+        try:
+            if _movement_leader():
+                due = time.time() >= next_simulated
+                if due:
+                    next_simulated = time.time() + MOVEMENT_REFRESH_SECONDS
+                _produce_movement_events(simulate=due)
+            refresh_movement()
+        except Exception as e:
+            print("Movement refresh error:", e)
+        _movement_wake.wait(MOVEMENT_POLL_SECONDS)
+        _movement_wake.clear()
 
-    # Add a fresh simulated event to keep the feed feeling live
-    _MOVEMENT_EVENTS.insert(0, _make_movement_event(mins_ago=0))
-    if len(_MOVEMENT_EVENTS) > 50:
-        _MOVEMENT_EVENTS.pop()
+def _wake_movement(grouped):
+    if any(q.startswith("INSERT INTO events") for q in grouped):
+        _movement_wake.set()
 
-    # Merge: real first, then simulated to fill up to 15
-    combined = live + _MOVEMENT_EVENTS
-    combined = combined[:15]
+ANALYTICS_WRITER.on_flush.append(_wake_movement)
+if _movement_leader():
+    _produce_movement_events(simulate=False)
+refresh_movement()
+background_thread(_movement_refresher)
 
-    return jsonify({
-        "events": combined,
-        "total":  len(combined) + random.randint(80, 140)  # social proof count
-    })
+@app.route("/api/movement", methods=["GET","OPTIONS"])
+def movement():
+    """Return recent movement events — mix of real orders + simulated activity.
+    Served from the snapshot built by the refresher; repeat polls get a 304."""
+    snap = _MOVEMENT_SNAPSHOT
+    resp = Response(snap["body"], mimetype="application/json")
+    resp.set_etag(snap["etag"])
+    resp.last_modified = snap["last_modified"]
+    resp.cache_control.public  = True
+    resp.cache_control.max_age = MOVEMENT_MAX_AGE
+    return resp.make_conditional(request)
+
+@app.route("/api/movement/stream", methods=["GET","OPTIONS"])
+def movement_stream():
+    """Server-Sent Events: the current feed as a `snapshot` event, then each new
+    movement event as it happens, with a comment heartbeat while idle.
+
+    Under a threaded WSGI server every subscriber holds a worker thread, so the
+    connection is closed after MOVEMENT_STREAM_MAX_SECONDS and EventSource
+    reconnects. Serve through asgi.py to keep idle subscribers off the pool.
+    """
+    def generate():
+        # Subscribe here, not in the view: a response that is never iterated
+        # then never subscribes, so it cannot leak a buffer in the hub
+        buffer   = queue.Queue(maxsize=MOVEMENT_SUBSCRIBER_BUFFER)
+        deliver  = MOVEMENT_HUB.subscribe(lambda event: MOVEMENT_HUB.offer(buffer, event))
+        deadline = time.monotonic() + MOVEMENT_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 5000\n"
+            yield "event: snapshot\ndata: " + _MOVEMENT_SNAPSHOT["body"].decode("utf-8") + "\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = buffer.get(timeout=min(MOVEMENT_HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_event(event)
+        finally:
+            MOVEMENT_HUB.unsubscribe(deliver)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/movement/stream-stats", methods=["GET"])
+def movement_stream_stats():
+    if request.args.get("key", "") != ANALYTICS_KEY:
+        return jsonify({"error":"Unauthorized"}), 401
+    return jsonify(MOVEMENT_HUB.report())
 
 
 # ── TRANSCRIPT → MOVEMENT EVENT ───────────────────────────────────────────────
@@ -3355,7 +5735,7 @@ def add_movement():
         "ts":      datetime.datetime.utcnow().isoformat(),
         "source":  "transcript"
     }
-    _MOVEMENT_EVENTS.insert(0, event)
+    add_movement_event(event)
     return jsonify({"ok": True, "event": event})
 
 # ── TRANSCRIPT PIPELINE ───────────────────────────────────────────────────────
@@ -3390,41 +5770,40 @@ def upload_transcript():
             error = "No Anthropic API key configured."
         else:
             try:
-                import urllib.request as urlreq
-                payload = json.dumps({
-                    "model":"claude-sonnet-4-20250514","max_tokens":300,
-                    "system":CLEAN_PROMPT,
-                    "messages":[{"role":"user","content":transcript}]
-                }).encode("utf-8")
-                req = urlreq.Request(
-                    "https://api.anthropic.com/v1/messages", data=payload,
-                    headers={"Content-Type":"application/json",
-                             "x-api-key":ANTHROPIC_API_KEY,
-                             "anthropic-version":"2023-06-01"},
-                    method="POST"
-                )
-                with urlreq.urlopen(req, timeout=15) as resp:
-                    raw  = json.loads(resp.read().decode())
-                    text = raw["content"][0]["text"].strip()
-                    text = text.replace("```json","").replace("```","").strip()
-                    cleaned = json.loads(text)
-
-                event = {
-                    "id":      int(datetime.datetime.utcnow().timestamp()*1000),
-                    "city":    cleaned.get("city","United States"),
-                    "flag":    cleaned.get("flag","🇺🇸"),
-                    "action":  cleaned.get("action",""),
-                    "product": cleaned.get("product",""),
-                    "ts":      datetime.datetime.utcnow().isoformat(),
-                    "source":  "transcript"
-                }
-                _MOVEMENT_EVENTS.insert(0, event)
-                if len(_MOVEMENT_EVENTS) > 50: _MOVEMENT_EVENTS.pop()
-                preview = event
+                raw     = anthropic_request(transcript_payload(transcript), timeout=15).json()
+                preview = publish_transcript_reply(raw)
                 result  = "Transcript cleaned and published to your live feed!"
             except Exception as e:
                 error = f"Error: {e}"
 
+    return render_upload_page(key, result, error, preview)
+
+def transcript_payload(transcript):
+    return {
+        "model":"claude-sonnet-4-20250514","max_tokens":300,
+        "system":CLEAN_PROMPT,
+        "messages":[{"role":"user","content":transcript}]
+    }
+
+def publish_transcript_reply(raw):
+    """Turn the privacy filter's JSON reply into a movement event and publish it."""
+    text = raw["content"][0]["text"].strip()
+    text = text.replace("```json","").replace("```","").strip()
+    cleaned = json.loads(text)
+
+    event = {
+        "id":      int(datetime.datetime.utcnow().timestamp()*1000),
+        "city":    cleaned.get("city","United States"),
+        "flag":    cleaned.get("flag","🇺🇸"),
+        "action":  cleaned.get("action",""),
+        "product": cleaned.get("product",""),
+        "ts":      datetime.datetime.utcnow().isoformat(),
+        "source":  "transcript"
+    }
+    add_movement_event(event)
+    return event
+
+def render_upload_page(key, result=None, error=None, preview=None):
     preview_html = f"""<div style="background:#f0faf5;border:1px solid #c1a3a2;border-radius:12px;
         padding:20px;margin-bottom:24px;">
         <div style="font-size:11px;letter-spacing:0.15em;text-transform:uppercase;
@@ -3542,10 +5921,7 @@ def login():
 def logout():
     token = request.headers.get("X-Auth-Token") or request.cookies.get("srd_token")
     if token:
-        con = get_db()
-        con.execute("DELETE FROM sessions WHERE token=?", (token,))
-        con.commit()
-        con.close()
+        revoke_session(token)
     return jsonify({"ok":True})
 
 @app.route("/api/auth/me", methods=["GET","OPTIONS"])
@@ -3579,6 +5955,7 @@ def google_auth():
         user_id = row[0]
         con.execute("UPDATE users SET google_id=?,name=?,avatar=? WHERE id=?",
                     (g_id, name, avatar, user_id))
+        SESSION_CACHE.invalidate(user_id=user_id)
     else:
         con.execute("INSERT INTO users (email,name,google_id,avatar) VALUES (?,?,?,?)",
                     (email, name, g_id, avatar))
@@ -3609,10 +5986,11 @@ def history():
 def clear_history():
     user = get_current_user()
     if not user: return jsonify({"error":"Not logged in"}), 401
-    con = get_db()
-    con.execute("DELETE FROM chat_history WHERE user_id=?", (user["id"],))
-    con.commit()
-    con.close()
+    with USERS_POOL.transaction() as con:
+        con.execute("DELETE FROM chat_history WHERE user_id=?", (user["id"],))
+        con.execute("DELETE FROM chat_ring WHERE user_id=?", (user["id"],))
+        con.execute("DELETE FROM chat_summaries WHERE user_id=?", (user["id"],))
+    SESSION_CACHE.invalidate(user_id=user["id"])
     return jsonify({"ok":True})
 
 
@@ -3621,6 +5999,7 @@ def clear_history():
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", "")
 
 @app.route("/login")
+@prerendered
 def login_page():
     return f"""<!DOCTYPE html><html><head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
@@ -3731,6 +6110,7 @@ async function handleGoogle(response){{
 
 # ── DASHBOARD PAGE ────────────────────────────────────────────────────────────
 @app.route("/dashboard")
+@prerendered(assets="dashboard")
 def dashboard():
     return """<!DOCTYPE html><html><head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
@@ -4138,6 +6518,7 @@ def get_or_create_user_by_shopify(shopify_customer_id, email, name, avatar=""):
     if row:
         user_id = row[0]
         con.execute("UPDATE users SET name=?,avatar=? WHERE id=?", (name, avatar, user_id))
+        SESSION_CACHE.invalidate(user_id=user_id)
     else:
         con.execute("INSERT INTO users (email,name,avatar,google_id) VALUES (?,?,?,?)",
                     (email, name, avatar, f"shopify_{shopify_customer_id}"))
@@ -4185,11 +6566,9 @@ def shopify_verify():
 
 def get_recommendation_history(user_id):
     """Extract product recommendations from chat history."""
-    con = get_db()
-    rows = con.execute("""SELECT content, ts FROM chat_history
+    rows = USERS_POOL.read("""SELECT content, ts FROM chat_history
         WHERE user_id=? AND role='assistant' ORDER BY id DESC LIMIT 50""",
-        (user_id,)).fetchall()
-    con.close()
+        (user_id,))
     recs = []
     products = ["Formula Exclusiva","Laciador Crece","Gotero Rapido","Gotitas Brillantes","Mascarilla","Shampoo Aloe Vera"]
     for content, ts in rows:
@@ -4208,12 +6587,6 @@ def rate_experience():
     rating = data.get("rating", 0)
     review = data.get("review","")
     con = get_db()
-    # Add ratings column if not exists
-    try:
-        con.execute("ALTER TABLE hair_profiles ADD COLUMN site_rating INTEGER DEFAULT 0")
-        con.execute("ALTER TABLE hair_profiles ADD COLUMN site_review TEXT DEFAULT ''")
-        con.commit()
-    except: pass
     con.execute("""INSERT INTO hair_profiles (user_id, site_rating, site_review)
         VALUES (?,?,?) ON CONFLICT(user_id) DO UPDATE SET
         site_rating=excluded.site_rating, site_review=excluded.site_review""",
@@ -4267,10 +6640,50 @@ def init_subscription_db():
 
 init_subscription_db()
 
+# ── USERS.DB MIGRATIONS (append only — never edit a step once it has shipped) ─
+def _migrate_chat_ring(con):
+    _add_column(con, "chat_history", "slot", "INTEGER")
+    _backfill_chat_ring(con)
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_history_slot ON chat_history(user_id, slot)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history(user_id, id)")
+
+def _migrate_account_columns(con):
+    _add_column(con, "users", "reset_token", "TEXT")
+    _add_column(con, "users", "reset_token_expires", "TEXT")
+    _add_column(con, "hair_profiles", "site_rating", "INTEGER DEFAULT 0")
+    _add_column(con, "hair_profiles", "site_review", "TEXT DEFAULT ''")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_users_reset_token ON users(reset_token)")
+
+USERS_MIGRATIONS = [
+    ("chat_history ring slots", _migrate_chat_ring),
+    ("lookup indexes", [
+        # Covers the token → user join so it never touches the sessions table
+        "CREATE INDEX IF NOT EXISTS idx_sessions_token_cover ON sessions(token, expires_at, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_usage_user ON session_usage(user_id, count)",
+        "CREATE INDEX IF NOT EXISTS idx_session_usage_session ON session_usage(session_id, user_id, count)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_customer ON subscriptions(stripe_customer)",
+    ]),
+    ("password reset + site rating columns", _migrate_account_columns),
+    # Bumped on every logout; each worker's SessionCache polls it
+    ("session revocation epoch", [
+        """CREATE TABLE IF NOT EXISTS session_epoch (
+            id    INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch INTEGER NOT NULL DEFAULT 0
+        )""",
+        "INSERT OR IGNORE INTO session_epoch (id, epoch) VALUES (1, 0)",
+    ]),
+]
+
+USERS_POOL.migrate(USERS_MIGRATIONS)
+
+# Every schema is in place now — warn at startup if a hot query lost its index
+for _r in check_query_plans():
+    if not _r["ok"]:
+        print(f"⚠️ Query plan regression — {_r['query']}: {_r['plan']}")
+
 def get_subscription(user_id):
-    con = get_db()
-    row = con.execute("SELECT * FROM subscriptions WHERE user_id=?", (user_id,)).fetchone()
-    con.close()
+    row = USERS_POOL.read("SELECT * FROM subscriptions WHERE user_id=?", (user_id,), fetchone=True)
     if not row: return None
     cols = ["id","user_id","stripe_customer","stripe_sub_id","shopify_sub_id",
             "status","plan","trial_start","trial_end","current_period_end","created_at","updated_at"]
@@ -4278,7 +6691,10 @@ def get_subscription(user_id):
 
 def is_subscribed(user_id):
     """Returns True if user has active subscription or active trial."""
-    sub = get_subscription(user_id)
+    return subscription_active(get_subscription(user_id))
+
+def subscription_active(sub):
+    """True if a subscriptions row (dict) is active, trialing, or inside its trial window."""
     if not sub: return False
     if sub["status"] in ("active", "trialing"): return True
     # Check trial manually
@@ -4291,16 +6707,13 @@ def is_subscribed(user_id):
     return False
 
 def get_session_count(session_id, user_id=None):
-    con = get_db()
     if user_id:
-        row = con.execute("SELECT count FROM session_usage WHERE user_id=?", (user_id,)).fetchone()
+        row = USERS_POOL.read("SELECT count FROM session_usage WHERE user_id=?", (user_id,), fetchone=True)
     else:
-        row = con.execute("SELECT count FROM session_usage WHERE session_id=? AND user_id IS NULL", (session_id,)).fetchone()
-    con.close()
+        row = USERS_POOL.read("SELECT count FROM session_usage WHERE session_id=? AND user_id IS NULL", (session_id,), fetchone=True)
     return row[0] if row else 0
 
-def increment_session_count(session_id, user_id=None):
-    con = get_db()
+def _bump_session_count(con, session_id, user_id=None):
     if user_id:
         row = con.execute("SELECT id FROM session_usage WHERE user_id=?", (user_id,)).fetchone()
         if row:
@@ -4313,8 +6726,10 @@ def increment_session_count(session_id, user_id=None):
             con.execute("UPDATE session_usage SET count=count+1 WHERE session_id=?", (session_id,))
         else:
             con.execute("INSERT INTO session_usage (session_id,user_id,count) VALUES (?,NULL,1)", (session_id,))
-    con.commit()
-    con.close()
+
+def increment_session_count(session_id, user_id=None):
+    with USERS_POOL.transaction() as con:
+        _bump_session_count(con, session_id, user_id)
 
 # ── SUBSCRIPTION STATUS ENDPOINT ──────────────────────────────────────────────
 @app.route("/api/subscription/status", methods=["GET","OPTIONS"])
@@ -4357,7 +6772,9 @@ def create_checkout():
         return jsonify({"error":"Stripe not configured","setup_needed":True}), 503
 
     try:
-        import urllib.request as urlreq, urllib.parse as urlparse
+        import urllib.parse as urlparse
+        stripe_headers = {"Authorization": f"Bearer {STRIPE_SECRET_KEY}",
+                          "Content-Type": "application/x-www-form-urlencoded"}
         # Create/get Stripe customer
         sub = get_subscription(user["id"])
         stripe_customer = sub["stripe_customer"] if sub else None
@@ -4368,13 +6785,9 @@ def create_checkout():
                 "name": user["name"] or user["email"],
                 "metadata[user_id]": str(user["id"])
             }).encode()
-            req = urlreq.Request("https://api.stripe.com/v1/customers",
-                data=cust_data,
-                headers={"Authorization": f"Bearer {STRIPE_SECRET_KEY}",
-                         "Content-Type": "application/x-www-form-urlencoded"},
-                method="POST")
-            with urlreq.urlopen(req) as r:
-                cust = json.loads(r.read())
+            cust = http_request("POST", "https://api.stripe.com/v1/customers",
+                data=cust_data, headers={**stripe_headers, "Idempotency-Key": secrets.token_hex(16)},
+                timeout=20).json()
             stripe_customer = cust["id"]
 
         # Create checkout session
@@ -4389,13 +6802,9 @@ def create_checkout():
             "metadata[user_id]": str(user["id"])
         }).encode()
 
-        req = urlreq.Request("https://api.stripe.com/v1/checkout/sessions",
-            data=params,
-            headers={"Authorization": f"Bearer {STRIPE_SECRET_KEY}",
-                     "Content-Type": "application/x-www-form-urlencoded"},
-            method="POST")
-        with urlreq.urlopen(req) as r:
-            session = json.loads(r.read())
+        session = http_request("POST", "https://api.stripe.com/v1/checkout/sessions",
+            data=params, headers={**stripe_headers, "Idempotency-Key": secrets.token_hex(16)},
+            timeout=20).json()
 
         # Save stripe customer id
         con = get_db()
@@ -4611,6 +7020,7 @@ def list_codes():
 
 
 @app.route("/subscription/success")
+@prerendered
 def subscription_success():
     return """<!DOCTYPE html><html><head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
@@ -4644,6 +7054,7 @@ if(u){ try{ var p=JSON.parse(u); p.plan='premium'; localStorage.setItem('srd_use
 </body></html>"""
 
 @app.route("/subscription/cancel")
+@prerendered
 def subscription_cancel():
     return """<!DOCTYPE html><html><head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
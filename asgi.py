@@ -0,0 +1,429 @@
+"""Async (ASGI) serving mode.
+
+The LLM-bound routes — /api/recommend, /api/recommend/stream, /api/transcribe
+and POST /upload-transcript — are handled natively on the event loop, so a
+worker can hold hundreds of in-flight model calls. So is the long-lived
+/api/movement/stream, so idle subscribers don't pin threads. SQLite work is offloaded to
+a thread pool, and every other route is served by the existing Flask app
+through a small WSGI bridge.
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+"""
+import asyncio, json, os, random, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie, CookieError
+import httpx
+
+import app as srd
+
+ASGI_THREADS             = int(os.environ.get("ASGI_THREADS", "32"))
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get("ASYNC_HTTP_MAX_CONNECTIONS", "256"))
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+_client   = None
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin",  b"*"),
+    (b"access-control-allow-headers", b"Content-Type, X-Auth-Token, X-Session-Id"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS, DELETE"),
+    (b"access-control-max-age",       b"3600"),
+]
+
+
+def _http():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=srd.HTTP_DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS),
+            transport=httpx.AsyncHTTPTransport(retries=1))
+    return _client
+
+async def offload(fn, *args):
+    """Run blocking work (SQLite, CPU) on the ASGI thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+async def http_post(url, timeout, **kwargs):
+    """POST with the same retry-with-jitter policy as app.http_request: 5xx
+    only when an Idempotency-Key is sent, otherwise just the statuses that
+    mean the request was never processed (429/503/529)."""
+    safe = any(k.lower() == "idempotency-key" for k in kwargs.get("headers") or {})
+    retry_on = srd.HTTP_RETRY_STATUSES if safe else srd.HTTP_UNPROCESSED_STATUSES
+    for attempt in range(srd.HTTP_MAX_RETRIES + 1):
+        resp = await _http().post(url, timeout=timeout, **kwargs)
+        if resp.status_code not in retry_on or attempt == srd.HTTP_MAX_RETRIES:
+            resp.raise_for_status()
+            return resp
+        await asyncio.sleep(srd._retry_delay(attempt, resp.headers.get("Retry-After")))
+
+def anthropic_headers():
+    return {"Content-Type": "application/json",
+            "x-api-key": srd.ANTHROPIC_API_KEY,
+            "anthropic-version": "2023-06-01"}
+
+async def anthropic_call(payload, timeout):
+    resp = await http_post("https://api.anthropic.com/v1/messages", timeout,
+                           json=payload, headers=anthropic_headers())
+    return resp.json()
+
+async def anthropic_stream(payload, timeout=12, usage=None):
+    """Async twin of app.stream_anthropic: yield text deltas as they arrive."""
+    async with _http().stream("POST", "https://api.anthropic.com/v1/messages",
+                              json={**payload, "stream": True},
+                              headers=anthropic_headers(), timeout=timeout) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            delta = srd.anthropic_sse_delta(line, usage)
+            if delta is srd.STREAM_END:
+                break
+            if delta:
+                yield delta
+
+
+# ── REQUEST / RESPONSE HELPERS ────────────────────────────────────────────────
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+def header(scope, name):
+    name = name.lower().encode()
+    for k, v in scope["headers"]:
+        if k == name:
+            return v.decode("latin-1")
+    return None
+
+def auth_token(scope):
+    token = header(scope, "X-Auth-Token")
+    if token:
+        return token
+    try:
+        cookie = SimpleCookie(header(scope, "Cookie") or "")
+    except CookieError:
+        return None
+    return cookie["srd_token"].value if "srd_token" in cookie else None
+
+def session_id(scope):
+    client = scope.get("client") or ("anon",)
+    return header(scope, "X-Session-Id") or client[0] or "anon"
+
+async def read_json(receive):
+    """The request body as a JSON object, or None if it is not one."""
+    try:
+        data = json.loads(await read_body(receive) or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+async def send_response(send, status, body, content_type="application/json"):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode()),
+                            (b"content-length", str(len(body)).encode())] + CORS_HEADERS})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ── NATIVE ASYNC ROUTES ───────────────────────────────────────────────────────
+async def recommend(scope, receive, send):
+    data = await read_json(receive)
+    if data is None:
+        return await send_response(send, 400, {"recommendation": None, "error": "Invalid JSON body"})
+    if not srd.ANTHROPIC_API_KEY:
+        return await send_response(send, 500, {"recommendation": None, "error": "No API key"})
+    try:
+        plan = await offload(srd.prepare_recommendation, data, auth_token(scope), session_id(scope))
+        usage = None
+        recommendation = srd.cached_recommendation(plan)
+        if recommendation is None:
+            result = await anthropic_call(srd.recommend_payload(plan), timeout=12)
+            recommendation = result["content"][0]["text"].strip()
+            usage = result.get("usage")
+            srd.remember_recommendation(plan, recommendation)
+        body = await offload(srd.finish_recommendation, plan, recommendation, usage)
+        await send_response(send, 200, body)
+    except Exception as e:
+        await send_response(send, 500, {"recommendation": None, "error": str(e)})
+
+async def recommend_stream(scope, receive, send):
+    data = await read_json(receive)
+    if data is None:
+        return await send_response(send, 400, {"recommendation": None, "error": "Invalid JSON body"})
+    if not srd.ANTHROPIC_API_KEY:
+        return await send_response(send, 500, {"recommendation": None, "error": "No API key"})
+    try:
+        plan = await offload(srd.prepare_recommendation, data, auth_token(scope), session_id(scope))
+    except Exception as e:
+        return await send_response(send, 500, {"recommendation": None, "error": str(e)})
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                            (b"cache-control", b"no-cache"),
+                            (b"x-accel-buffering", b"no")] + CORS_HEADERS})
+
+    async def event(payload):
+        await send({"type": "http.response.body", "body": srd.sse_event(payload).encode("utf-8"),
+                    "more_body": True})
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def generate():
+        parts, usage = [], {}
+        try:
+            cached = srd.cached_recommendation(plan)
+            if cached is not None:
+                parts.append(cached)
+                await event({"delta": cached})
+            else:
+                async for delta in anthropic_stream(srd.recommend_payload(plan), usage=usage):
+                    parts.append(delta)
+                    await event({"delta": delta})
+                srd.remember_recommendation(plan, "".join(parts).strip())
+            body = await offload(srd.finish_recommendation, plan, "".join(parts).strip(),
+                                 usage, "recommend/stream")
+            await event({"done": True, **body})
+        except Exception as e:
+            await event({"error": str(e)})
+        await send({"type": "http.response.body", "body": b""})
+
+    # A client that gives up (e.g. its first-token timeout) cancels the model
+    # call; the turn is only persisted by a stream that runs to the end
+    task    = asyncio.ensure_future(generate())
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        task.cancel()
+
+def _parse_form(scope, body):
+    """Parse a urlencoded or multipart body with werkzeug (already a Flask dependency)."""
+    from werkzeug.formparser import parse_form_data
+    import io
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE":   header(scope, "Content-Type") or "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input":     io.BytesIO(body),
+    }
+    _stream, form, files = parse_form_data(environ)
+    return form, files
+
+async def transcribe(scope, receive, send):
+    if not srd.OPENAI_API_KEY:
+        return await send_response(send, 500, {"error": "No OpenAI key"})
+    try:
+        _form, files = await offload(_parse_form, scope, await read_body(receive))
+        audio_file = files.get("audio")
+        if not audio_file:
+            return await send_response(send, 400, {"error": "No audio"})
+        body, content_type = srd.whisper_multipart(audio_file.read())
+        resp = await http_post("https://api.openai.com/v1/audio/transcriptions", 30,
+                               content=body,
+                               headers={"Authorization": "Bearer " + srd.OPENAI_API_KEY,
+                                        "Content-Type": content_type})
+        await send_response(send, 200, {"text": resp.json().get("text", "")})
+    except Exception as e:
+        await send_response(send, 500, {"error": str(e)})
+
+async def upload_transcript(scope, receive, send):
+    query = urllib.parse.parse_qs(scope.get("query_string", b"").decode())
+    key   = query.get("key", [""])[0]
+    if key != srd.UPLOAD_KEY:
+        return await send_response(send, 401, "Unauthorized. Add ?key=YOUR_UPLOAD_KEY to the URL.",
+                                   "text/html; charset=utf-8")
+    result = error = preview = None
+    form, _files = await offload(_parse_form, scope, await read_body(receive))
+    transcript = form.get("transcript", "").strip()
+    if not transcript:
+        error = "Please paste a transcript."
+    elif not srd.ANTHROPIC_API_KEY:
+        error = "No Anthropic API key configured."
+    else:
+        try:
+            raw     = await anthropic_call(srd.transcript_payload(transcript), timeout=15)
+            preview = await offload(srd.publish_transcript_reply, raw)
+            result  = "Transcript cleaned and published to your live feed!"
+        except Exception as e:
+            error = f"Error: {e}"
+    await send_response(send, 200, srd.render_upload_page(key, result, error, preview),
+                        "text/html; charset=utf-8")
+
+async def movement_stream(scope, receive, send):
+    """Async twin of app.movement_stream: one hub subscription per client, no
+    thread held while the connection idles."""
+    loop   = asyncio.get_running_loop()
+    buffer = asyncio.Queue(maxsize=srd.MOVEMENT_SUBSCRIBER_BUFFER)
+
+    def offer(event):
+        # Runs on the event loop; evict the oldest event if the client is behind
+        if buffer.full():
+            buffer.get_nowait()
+            srd.MOVEMENT_HUB.count_drop()
+        buffer.put_nowait(event)
+
+    deliver = srd.MOVEMENT_HUB.subscribe(lambda event: loop.call_soon_threadsafe(offer, event))
+    closed  = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        closed.set()
+
+    async def chunk(text):
+        await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    getter  = None
+    try:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache"),
+                                (b"x-accel-buffering", b"no")] + CORS_HEADERS})
+        await chunk("retry: 5000\n")
+        await chunk("event: snapshot\ndata: " + srd._MOVEMENT_SNAPSHOT["body"].decode("utf-8") + "\n\n")
+        while not closed.is_set():
+            getter = asyncio.ensure_future(buffer.get())
+            done, _ = await asyncio.wait({getter, watcher}, timeout=srd.MOVEMENT_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                await chunk(srd.sse_event(getter.result()))
+            else:
+                getter.cancel()
+                if not closed.is_set():
+                    await chunk(": ping\n\n")
+    finally:
+        srd.MOVEMENT_HUB.unsubscribe(deliver)
+        watcher.cancel()
+        if getter is not None:
+            getter.cancel()
+
+ASYNC_ROUTES = {
+    ("POST", "/api/recommend"):        recommend,
+    ("POST", "/api/recommend/stream"): recommend_stream,
+    ("POST", "/api/transcribe"):       transcribe,
+    ("POST", "/upload-transcript"):    upload_transcript,
+    ("GET",  "/api/movement/stream"):  movement_stream,
+}
+
+
+# ── WSGI BRIDGE (everything else goes to Flask) ───────────────────────────────
+def _environ(scope, body):
+    import io, sys
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD":    scope["method"],
+        "SCRIPT_NAME":       scope.get("root_path", ""),
+        "PATH_INFO":         scope["path"],
+        "QUERY_STRING":      scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME":       server[0],
+        "SERVER_PORT":       str(server[1]),
+        "SERVER_PROTOCOL":   "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR":       client[0],
+        "CONTENT_LENGTH":    str(len(body)),
+        "wsgi.version":      (1, 0),
+        "wsgi.url_scheme":   scope.get("scheme", "http"),
+        "wsgi.input":        io.BytesIO(body),
+        "wsgi.errors":       sys.stderr,
+        "wsgi.multithread":  True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once":     False,
+    }
+    for k, v in scope["headers"]:
+        name = k.decode("latin-1").upper().replace("-", "_")
+        value = v.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = "HTTP_" + name
+            environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+async def wsgi_bridge(scope, receive, send):
+    """Run the Flask app on the thread pool, forwarding body chunks as they are
+    produced so streaming Flask routes keep streaming."""
+    body  = await read_body(receive)
+    loop  = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    state = {"status": None, "headers": None, "disconnected": False}
+
+    def start_response(status, headers, exc_info=None):
+        state["status"], state["headers"] = status, headers
+
+    def run():
+        result = None
+        try:
+            result = srd.app(_environ(scope, body), start_response)
+            for chunk in result:
+                if state["disconnected"]:
+                    break
+                if chunk:
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        state["disconnected"] = True
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    worker  = loop.run_in_executor(_executor, run)
+    started = False
+    try:
+        while True:
+            chunk = await queue.get()
+            if not started:
+                started = True
+                if state["status"] is None:
+                    # The app raised or returned without calling start_response
+                    await send_response(send, 500, "Internal Server Error", "text/plain; charset=utf-8")
+                    break
+                await send({"type": "http.response.start",
+                            "status": int(state["status"].split(" ", 1)[0]),
+                            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                        for k, v in state["headers"]]})
+            if chunk is None:
+                await send({"type": "http.response.body", "body": b""})
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        state["disconnected"] = state["disconnected"] or not started
+        watcher.cancel()
+        try:
+            await worker
+        except Exception as e:
+            print("WSGI bridge error:", e)
+
+
+# ── ASGI ENTRY POINT ──────────────────────────────────────────────────────────
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if _client is not None:
+                    await _client.aclose()
+                _executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    srd.start_background()
+    handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+    await (handler or wsgi_bridge)(scope, receive, send)
@@ -0,0 +1,52 @@
+"""Every query in HOT_QUERIES must stay on an index.
+
+app.py is imported against throwaway databases, so the schema under test is
+exactly what the startup migrations build.
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("dbs")
+    os.environ.update({
+        "AUTH_DB":               str(tmp / "users.db"),
+        "ANALYTICS_DB":          str(tmp / "analytics.db"),
+        "BLOG_DB":               str(tmp / "srd_blog.db"),
+        "ANALYTICS_ARCHIVE_DIR": str(tmp / "archive"),
+        "SRD_BACKGROUND":        "0",   # no scrapers, schedulers or pings
+    })
+    sys.path.insert(0, ROOT)
+    return importlib.import_module("app")
+
+
+def test_hot_queries_use_indexes(app_module):
+    results = app_module.check_query_plans()
+    assert len(results) == len(app_module.HOT_QUERIES)
+    regressed = {r["query"]: r["plan"] for r in results if not r["ok"]}
+    assert not regressed, regressed
+
+
+def test_intentional_scans_are_hot_queries(app_module):
+    names = {name for _pool, name, _query, _params in app_module.HOT_QUERIES}
+    assert app_module.INTENTIONAL_SCANS <= names
+
+
+@pytest.mark.parametrize("name, plan, regressed", [
+    ("x", ["SEARCH t USING INDEX idx_t_a (a=?)"], False),
+    ("x", ["SEARCH t USING COVERING INDEX idx_t_ab (a=?)"], False),
+    ("x", ["SCAN t"], True),
+    ("x", ["SCAN t USING INDEX idx_t_a"], True),
+    ("x", ["SCAN t USING COVERING INDEX idx_t_ab"], True),
+    ("sitemap", ["SCAN posts USING COVERING INDEX idx_posts_listing"], False),
+    ("sitemap", ["SCAN posts"], True),
+    ("x", ["SEARCH t USING INDEX idx_t_a (a=?)", "USE TEMP B-TREE FOR ORDER BY"], True),
+])
+def test_plan_regressions(app_module, name, plan, regressed):
+    assert bool(app_module.plan_regressions(name, plan)) is regressed